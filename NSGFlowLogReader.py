@@ -5,6 +5,18 @@ import os
 import json
 import threading
 import queue
+import sys
+import re
+import bisect
+import functools
+import contextlib
+import codecs
+import heapq
+import itertools
+import operator
+import time
+import zlib
+from collections import Counter, OrderedDict
 
 
 # ----------------------------------------------------------------------
@@ -20,7 +32,8 @@ def _load_history() -> dict:
         {
             "src":  [<last used source values>],
             "dst":  [<last used destination values>],
-            "port": [<last used port values>]
+            "port": [<last used port values>],
+            "query": [<last used query expressions>]
         }
 
     If the file does not exist or is malformed an empty dict is returned.
@@ -32,7 +45,7 @@ def _load_history() -> dict:
         with open(HISTORY_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)          # store JSON → easier than custom format
             # make sure we have lists
-            for k in ("src", "dst", "port"):
+            for k in ("src", "dst", "port", "query"):
                 if not isinstance(data.get(k), list):
                     data[k] = []
             return data
@@ -46,6 +59,68 @@ def _save_history(history: dict) -> None:
         json.dump(history, f, indent=2, sort_keys=True)
 
 
+# ----------------------------------------------------------------------
+# Hourly rollups persistence
+# ----------------------------------------------------------------------
+ROLLUP_FILE = "flowrollups.json"
+ROLLUP_SAVE_SEC = 30    # the catalog is rewritten at most this often while in use
+
+def _load_rollups() -> dict:
+    """
+    Reads ROLLUP_FILE and returns
+
+        {"files": {<source>: {"sig": [mtime_ns, size, member],
+                              "hours": {<hour epoch s>: [[flowState, nsg, rule,
+                                         direction, tuples, bytes, packets], …]}}}}
+
+    An empty catalog is returned if the file is missing or malformed.
+    """
+    if not os.path.isfile(ROLLUP_FILE):
+        return {"files": {}}
+    try:
+        with open(ROLLUP_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data.get("files"), dict):
+            return {"files": {}}
+        return data
+    except Exception:
+        return {"files": {}}
+
+
+def _save_rollups(rollups: dict) -> None:
+    """Writes the rollup catalog to ROLLUP_FILE (compact JSON)."""
+    tmp = ROLLUP_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(rollups, f, separators=(",", ":"))
+    os.replace(tmp, ROLLUP_FILE)
+
+
+# ----------------------------------------------------------------------
+# Saved rules (named queries, used by the Rules window and --watch)
+# ----------------------------------------------------------------------
+RULES_FILE = "flowrules.json"
+
+def _load_rules(path=RULES_FILE) -> dict:
+    """
+    Reads the rules file and returns {<rule name>: <query expression>}.
+    If the file does not exist or is malformed an empty dict is returned.
+    """
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {str(k): str(v) for k, v in data.items()}
+    except Exception:
+        return {}
+
+
+def _save_rules(rules: dict, path=RULES_FILE) -> None:
+    """Writes the rules to the rules file (pretty‑printed JSON)."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rules, f, indent=2, sort_keys=True)
+
+
 # Global mapping arrays for field names
 arrFlowMap = [
     "UnixEpoch", "vnet", "nsg", "rule",
@@ -93,7 +168,8 @@ flow_state_map = {
     "B": "Begin",
     "C": "Continuing",
     "E": "End",
-    "D": "Deny"
+    "D": "Deny",
+    "A": "Allowed"        # NSG v1 logs: allowed, no flow state recorded
 }
 
 # Column names for the final table
@@ -106,27 +182,1799 @@ COLUMNS = [
     "packetsDstToSrc", "bytesDestToSrc"
 ]
 
+# Row entry holding the typed sort keys (aligned with COLUMNS).  Rows keep
+# their display strings for the Treeview; the keys are built once while
+# parsing so sorting never has to re-parse "1234" or "10.0.0.4".
+SORT_KEYS = "_keys"
+
+# ----------------------------------------------------------------------
+# Parse-time symbol table
+# ----------------------------------------------------------------------
+# Flow logs repeat the same few thousand IPs, ports, rule and resource
+# names millions of times.  These low-cardinality tuple fields and names
+# are interned as they are split, so every row refers to one shared string
+# per distinct value (timestamps and counters are left alone), and values
+# derived from them (display text, IP and port keys, lower-cased names,
+# names taken from resource IDs) are computed once per distinct input.
+_intern = sys.intern
+SYMBOL_CACHE_SIZE = 1 << 16     # distinct inputs remembered per derived value
+
+def _int_key(value):
+    """Numeric sort key for counters/ports/epochs (-1 for blanks or junk)."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+# ports repeat, so their (shared) int keys are memoised
+_port_key = functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)(_int_key)
+_lower_key = functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)(str.lower)
+
+@functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)
+def ip_sort_key(value):
+    """
+    Integer sort key for an IP address string.
+    IPv4 sorts before IPv6; anything unparsable sorts first (-1).
+    """
+    parts = value.split('.')
+    if len(parts) == 4:
+        try:
+            a, b, c, d = (int(p) for p in parts)
+            return (a << 24) | (b << 16) | (c << 8) | d
+        except ValueError:
+            return -1
+    if ':' in value:
+        import ipaddress
+        try:
+            return (1 << 128) + int(ipaddress.IPv6Address(value))
+        except ValueError:
+            return -1
+    return -1
+
+def make_sort_keys(fields, vnet, nsg, rule):
+    """Build the typed key tuple for one 13-field flow tuple (COLUMNS order)."""
+    try:
+        # usual case: timestamp and all four counters are numbers
+        ts, p1, b1, p2, b2 = (int(fields[0]), int(fields[9]), int(fields[10]),
+                              int(fields[11]), int(fields[12]))
+    except ValueError:
+        ts, p1, b1, p2, b2 = (_int_key(fields[i]) for i in (0, 9, 10, 11, 12))
+    return (
+        ts,                                         # Timestamp (epoch ms)
+        _lower_key(vnet), _lower_key(nsg), _lower_key(rule),
+        ip_sort_key(fields[1]), ip_sort_key(fields[2]),
+        _port_key(fields[3]), _port_key(fields[4]), # ports
+        _port_key(fields[5]),                       # proto number
+        fields[6], fields[7], fields[8],            # flow / state / encryption
+        p1, b1, p2, b2,
+    )
+
+class ColumnStats:
+    """
+    Per-column statistics of the rows shown in a data window: the longest
+    display string per column, which is all that window sizing and column
+    autosize need.  It is gathered batch by batch while the rows are
+    parsed, so the table is never rescanned for it.  Parses that never
+    feed a window (search, rollups, sessions) do not collect it at all.
+    """
+
+    def __init__(self, columns=COLUMNS):
+        self.columns = list(columns)
+        self.rows = 0
+        self.max_len = {c: 0 for c in self.columns}
+
+    @classmethod
+    def from_rows(cls, rows, columns=COLUMNS):
+        stats = cls(columns)
+        stats.add_rows(rows)
+        return stats
+
+    def add_rows(self, rows):
+        """Update the display lengths with a batch of rows."""
+        if not rows:
+            return
+        self.rows += len(rows)
+        # transpose the batch into columns with C-level iteration
+        try:
+            columns = zip(*map(operator.itemgetter(*self.columns), rows))
+        except KeyError:
+            columns = zip(*([r.get(c, "") for c in self.columns] for r in rows))
+        for col, values in zip(self.columns, columns):
+            try:
+                n = max(map(len, values))
+            except TypeError:           # non-string cells
+                n = max(map(len, map(str, values)))
+            if n > self.max_len[col]:
+                self.max_len[col] = n
+
+    def row_width(self):
+        """Upper bound of the widest row, in characters."""
+        return sum(self.max_len.values())
+
+# ----------------------------------------------------------------------
+# Flow log sources: plain .json, gzip'ed .json.gz and .json members of .zip
+# ----------------------------------------------------------------------
+# A zip member is addressed as "<archive path>::<member name>".
+ZIP_MEMBER_SEP = "::"
+
+def is_flow_log_name(filename):
+    """True for file names the catalog lists (.json, .json.gz, .zip)."""
+    name = filename.lower()
+    return name.endswith(('.json', '.json.gz', '.zip'))
+
+def split_source(source):
+    """Return (file path, zip member or None) for a source id."""
+    path, sep, member = source.rpartition(ZIP_MEMBER_SEP)
+    if sep and path.lower().endswith('.zip'):
+        return path, member
+    return source, None
+
+def zip_json_members(zip_path):
+    """Names of the .json members of a zip archive ([] if unreadable)."""
+    import zipfile
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            return [info.filename for info in zf.infolist()
+                    if not info.is_dir() and info.filename.lower().endswith('.json')]
+    except (zipfile.BadZipFile, OSError):
+        return []
+
+def expand_source(path):
+    """A file on disk -> the flow log sources it contains."""
+    if path.lower().endswith('.zip'):
+        return [f"{path}{ZIP_MEMBER_SEP}{m}" for m in zip_json_members(path)]
+    return [path]
+
+def iter_flow_log_files(top):
+    """
+    Walk `top` and yield `(source, relative label)` for every flow log:
+    .json and .json.gz files and the .json members of .zip archives.
+    """
+    for root, _, files in os.walk(top):
+        for filename in files:
+            if not is_flow_log_name(filename):
+                continue
+            full_path = os.path.join(root, filename)
+            for source in expand_source(full_path):
+                yield source, os.path.relpath(source, top)
+
+@contextlib.contextmanager
+def open_flow_log(source):
+    """
+    Open a flow log source for binary reading, decompressing on the fly.
+    Yields `(stream, total, position)`, where `position()` reports progress
+    in the same unit as `total` (bytes of the file on disk, or of the
+    uncompressed member for zip archives).
+    """
+    path, member = split_source(source)
+    if member is not None:
+        import zipfile
+        with zipfile.ZipFile(path) as zf:
+            info = zf.getinfo(member)
+            with zf.open(info) as stream:
+                yield stream, info.file_size, stream.tell
+    elif path.lower().endswith('.gz'):
+        import gzip
+        with open(path, 'rb') as raw, gzip.GzipFile(fileobj=raw) as stream:
+            yield stream, os.fstat(raw.fileno()).st_size, raw.tell
+    else:
+        with open(path, 'rb') as f:
+            yield f, os.fstat(f.fileno()).st_size, f.tell
+
+def read_flow_log_bytes(source):
+    """Whole (decompressed) content of a flow log source."""
+    with open_flow_log(source) as (stream, _, _):
+        return stream.read()
+
+def source_signature(source):
+    """(mtime, size) of the file behind a source, plus the zip member name."""
+    path, member = split_source(source)
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, member)
+
+# ----------------------------------------------------------------------
+# Parsed-file cache
+# ----------------------------------------------------------------------
+# Memory budget for parsed rows kept between opens/searches.  Override with
+# the NSG_CACHE_MB environment variable.
+try:
+    CACHE_BUDGET_MB = int(os.environ.get("NSG_CACHE_MB", "512"))
+except ValueError:
+    CACHE_BUDGET_MB = 512
+
+def _shared_size(obj):
+    """sys.getsizeof(obj) split between everything referring to it."""
+    # getrefcount also sees the caller's loop variable, `obj` and its own
+    # argument
+    return sys.getsizeof(obj) / max(1, sys.getrefcount(obj) - 3)
+
+def estimate_rows_bytes(rows, sample=64):
+    """
+    Approximate memory held by a list of row dicts (sampled, not exact).
+    Row values are mostly interned strings shared by many rows, so each
+    value only counts its share: its size divided by its reference count.
+    """
+    if not rows:
+        return sys.getsizeof(rows)
+    step = max(1, len(rows) // sample)
+    picked = rows[::step][:sample]
+    per_row = 0.0
+    for row in picked:
+        per_row += sys.getsizeof(row)
+        for value in row.values():
+            per_row += _shared_size(value)
+            if isinstance(value, tuple):
+                for key in value:
+                    per_row += _shared_size(key)
+    return sys.getsizeof(rows) + int(per_row * len(rows) / len(picked))
+
+class ParsedFileCache:
+    """
+    LRU cache of the flow log files opened in data windows.  Sessions,
+    search and compare reuse cached files but never add to the cache.
+    Entries are keyed by source (path or zip member) and validated against
+    the file's mtime and size, so an edited file is re-parsed.  When the
+    approximate size of the cached rows exceeds `budget_bytes` the least
+    recently used files are evicted.
+
+    A lookup that finds nothing is not a miss by itself: only a file that
+    had to be parsed and was then stored with put() counts as one.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()   # path -> (signature, rows, stats, nbytes)
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def signature(path):
+        return source_signature(path)
+
+    def peek(self, path):
+        """Return `(rows, stats)` if `path` is cached and current, else None."""
+        sig = self.signature(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == sig:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1], entry[2]
+            return None
+
+    def put(self, path, rows, stats):
+        """Store rows parsed because peek() found nothing (one miss)."""
+        sig = self.signature(path)
+        nbytes = estimate_rows_bytes(rows)
+        with self._lock:
+            self.misses += 1
+            self._discard(path)
+            if nbytes > self.budget_bytes:
+                return                    # would evict everything – don't cache
+            self._entries[path] = (sig, rows, stats, nbytes)
+            self.used_bytes += nbytes
+            while self.used_bytes > self.budget_bytes and len(self._entries) > 1:
+                old_path = next(iter(self._entries))
+                self._discard(old_path)
+                self.evictions += 1
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.used_bytes -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def summary(self):
+        """One-line description for the UI."""
+        mb = 1024 * 1024
+        return (f"Cache: {len(self._entries)} file(s), "
+                f"{self.used_bytes / mb:.0f}/{self.budget_bytes / mb:.0f} MB | "
+                f"hits {self.hits}  misses {self.misses}  "
+                f"evictions {self.evictions}")
+
+# ----------------------------------------------------------------------
+# Background file loading
+# ----------------------------------------------------------------------
+READ_CHUNK = 1 << 20          # bytes read per progress report
+LOAD_BATCH_ROWS = 5000        # rows handed to the window per batch
+DISCOVERY_BATCH = 500         # file names added to the list per batch
+DISCOVERY_FLUSH_SEC = 0.25    # … or sooner, when the walk is slow
+
+_RECORDS_START_RE = re.compile(r'\s*\{\s*"records"\s*:\s*\[')
+_RECORD_SEP_RE = re.compile(r'[\s,]*')
+
+def iter_json_records(text, start=None):
+    """
+    Yield `(record, end_offset)` for each element of the top-level
+    "records" array, decoding one record at a time so a worker thread never
+    holds the interpreter for the whole document.  Documents that do not
+    start with {"records": [ are decoded in one go.
+    """
+    if start is None:
+        m = _RECORDS_START_RE.match(text)
+        if not m:
+            for record in json.loads(text).get("records", []):
+                yield record, len(text)
+            return
+        start = m.end()
+
+    decoder = json.JSONDecoder()
+    pos = start
+    while True:
+        pos = _RECORD_SEP_RE.match(text, pos).end()
+        if pos >= len(text) or text[pos] == ']':
+            return
+        record, pos = decoder.raw_decode(text, pos)
+        yield record, pos
+
+def iter_stream_records(stream, chunk_size=READ_CHUNK):
+    """
+    Yield each element of the top-level "records" array of a binary
+    `stream` while it is still being read.  Chunks are decoded
+    incrementally and every record complete in the buffer is decoded at
+    once, so only the unparsed tail of the text is held.  A record cut off
+    by the end of the buffer is retried only once the tail has doubled,
+    which keeps very large records linear.  Documents that do not start
+    with {"records": [ are read and decoded in one go.
+    """
+    decode = codecs.getincrementaldecoder('utf-8-sig')().decode
+    decoder = json.JSONDecoder()
+    text, pos, need, started = "", 0, 0, False
+    while True:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        text = text[pos:] + decode(chunk, final=eof)
+        pos = 0
+        if not started:
+            m = _RECORDS_START_RE.match(text)
+            if m is None:
+                if not eof and len(text.lstrip()) < 64:
+                    continue            # too little text to tell yet
+                text += decode(stream.read(), final=True)
+                yield from json.loads(text).get("records", [])
+                return
+            pos, started = m.end(), True
+        if not eof and len(text) - pos < need:
+            continue
+        while True:
+            pos = _RECORD_SEP_RE.match(text, pos).end()
+            if pos >= len(text):
+                break
+            if text[pos] == ']':
+                return
+            try:
+                record, pos = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                need = 2 * (len(text) - pos)    # incomplete, wait for more
+                break
+            need = 0
+            yield record
+        if eof:
+            return
+
+class BackgroundLoader:
+    """
+    Reads (decompressing .gz / zip members on the fly) and parses one flow
+    log source on a worker thread.
+
+    `process(records, path, stats, fmt)` turns raw records into rows (the
+    app's _process_records_for_display).  Progress is posted to `self.messages`:
+
+        ('PREVIEW', rows, estimated)    – sampled rows of a large file
+        ('PROGRESS', bytes_read, total_bytes, records, rows)
+        ('ROWS', batch)                 – newly parsed rows
+        ('DONE', rows, stats)           – complete result
+        ('ERROR', message)
+
+    `cancel()` stops the worker at the next chunk/record.  `on_complete`
+    (called on the worker thread) receives `(rows, stats)` of a load that
+    was not cancelled.  Passing `preloaded=(rows, stats)` yields an already
+    finished loader, used for cache hits.  With `preview=True` a plain
+    .json file of PREVIEW_MIN_BYTES or more is sampled first.
+    """
+
+    def __init__(self, path, process, on_complete=None, preloaded=None,
+                 batch_rows=LOAD_BATCH_ROWS, preview=False):
+        self.path = path
+        self.messages = queue.Queue()
+        self._process = process
+        self._on_complete = on_complete
+        self._preloaded = preloaded
+        self._batch_rows = batch_rows
+        self._preview = preview
+        self._cancel = threading.Event()
+
+    def start(self):
+        if self._preloaded is not None:
+            rows, stats = self._preloaded
+            self.messages.put(('ROWS', rows))
+            self.messages.put(('DONE', rows, stats))
+            return self
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _post_preview(self):
+        path, member = split_source(self.path)
+        if member is not None or path.lower().endswith('.gz'):
+            return                      # compressed data cannot be sampled by offset
+        if os.path.getsize(path) < PREVIEW_MIN_BYTES:
+            return
+        rows, estimated = sample_flow_log(path)
+        if rows:
+            self.messages.put(('PREVIEW', rows, estimated))
+
+    def _run(self):
+        try:
+            if self._preview:
+                self._post_preview()
+
+            # records are parsed and posted in batches while the file
+            # (or the decompressed stream) is still being read
+            stats = ColumnStats()
+            rows, batch_start, n_records = [], 0, 0
+            fmt = None                  # detected from the first record
+            with open_flow_log(self.path) as (stream, total, position):
+                reported = 0
+                for record in iter_stream_records(stream):
+                    if self.cancelled:
+                        return
+                    if fmt is None:
+                        fmt = detect_format(record)
+                    rows.extend(self._process([record], self.path, None, fmt))
+                    n_records += 1
+                    flushed = len(rows) - batch_start >= self._batch_rows
+                    if flushed:
+                        stats.add_rows(rows[batch_start:])
+                        self.messages.put(('ROWS', rows[batch_start:]))
+                        batch_start = len(rows)
+                    done = position()
+                    if flushed or done - reported >= READ_CHUNK:
+                        reported = done
+                        self.messages.put(('PROGRESS', done, total, n_records, len(rows)))
+            if len(rows) > batch_start:
+                stats.add_rows(rows[batch_start:])
+                self.messages.put(('ROWS', rows[batch_start:]))
+            self.messages.put(('PROGRESS', total, total, n_records, len(rows)))
+
+            if self._on_complete is not None:
+                self._on_complete(rows, stats)
+            self.messages.put(('DONE', rows, stats))
+        except Exception as e:
+            self.messages.put(('ERROR', str(e)))
+
+# ----------------------------------------------------------------------
+# Query expressions
+# ----------------------------------------------------------------------
+# A small filter language over COLUMNS, e.g.
+#
+#     flowState=D and proto=TCP and bytesSrcToDest>1e6 and rule~Deny*
+#     destIP=10.1.0.0/16 and not (destPort=443 or destPort=80)
+#
+# Operators:  =  !=  >  >=  <  <=  ~ (glob)  !~  contains
+# Clauses are joined with `and` (or juxtaposition), `or`, `not` and
+# parentheses.  A bare word matches any column containing it, a bare
+# "quoted value" any column equal to it.  IP columns accept CIDR ranges,
+# coded columns (proto, trafficFlow, flowState, encryption) accept the
+# code or its name, Timestamp accepts epoch ms or "YYYY-MM-DD HH:MM:SS".
+#
+# A query is parsed once and compiled into a single Python function, with
+# the cheap, selective clauses of each and/or group evaluated first.
+
+class QueryError(ValueError):
+    """Raised for a query that cannot be parsed or compiled."""
+
+_NUMERIC_COLUMNS = {"sourcePort", "destPort", "packetsSrcToDest",
+                    "bytesSrcToDest", "packetsDstToSrc", "bytesDestToSrc"}
+_IP_COLUMNS = {"sourceIP", "destIP"}
+_CODE_MAPS = {"proto": proto_map, "trafficFlow": traffic_flow_map,
+              "flowState": flow_state_map, "encryption": encryption_map}
+
+_COLUMN_ALIASES = {c.lower(): c for c in COLUMNS}
+_COLUMN_ALIASES.update({"src": "sourceIP", "dst": "destIP", "sport": "sourcePort",
+                        "dport": "destPort", "port": "destPort",
+                        "state": "flowState", "direction": "trafficFlow",
+                        "time": "Timestamp"})
+
+_WORD_RE = re.compile(r'[^\s()"=<>!~]+')
+_VALUE_RE = re.compile(r'[^\s()"]+')
+_OP_RE = re.compile(r'\s*(!=|>=|<=|!~|=|>|<|~|contains\b)', re.I)
+_QUOTED_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def _unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+def quote_query_value(value):
+    """Quote a literal for use inside a query string."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+class _QueryParser:
+    """Recursive-descent parser producing a small tuple AST."""
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def parse(self):
+        node = self.parse_or()
+        self.skip_ws()
+        if self.pos < len(self.text):
+            raise QueryError(f"Unexpected text at position {self.pos + 1}: "
+                             f"{self.text[self.pos:self.pos + 20]!r}")
+        return node
+
+    def skip_ws(self):
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def peek_keyword(self, word):
+        self.skip_ws()
+        end = self.pos + len(word)
+        if (self.text[self.pos:end].lower() == word and
+                (end >= len(self.text) or self.text[end].isspace() or self.text[end] == '(')):
+            return end
+        return None
+
+    def at_group_end(self):
+        self.skip_ws()
+        return (self.pos >= len(self.text) or self.text[self.pos] == ')' or
+                self.peek_keyword("or") is not None)
+
+    def parse_or(self):
+        items = [self.parse_and()]
+        while True:
+            end = self.peek_keyword("or")
+            if end is None:
+                break
+            self.pos = end
+            items.append(self.parse_and())
+        return items[0] if len(items) == 1 else ("or", items)
+
+    def parse_and(self):
+        items = [self.parse_not()]
+        while not self.at_group_end():
+            end = self.peek_keyword("and")
+            if end is not None:
+                self.pos = end
+            items.append(self.parse_not())
+        return items[0] if len(items) == 1 else ("and", items)
+
+    def parse_not(self):
+        end = self.peek_keyword("not")
+        if end is not None:
+            self.pos = end
+            return ("not", self.parse_not())
+        return self.parse_atom()
+
+    def read_quoted(self):
+        m = _QUOTED_RE.match(self.text, self.pos)
+        if not m:
+            raise QueryError(f"Unterminated quote at position {self.pos + 1}")
+        self.pos = m.end()
+        return _unescape(m.group(1))
+
+    def parse_atom(self):
+        self.skip_ws()
+        if self.pos >= len(self.text):
+            raise QueryError("Query ends unexpectedly")
+        ch = self.text[self.pos]
+        if ch == '(':
+            self.pos += 1
+            node = self.parse_or()
+            self.skip_ws()
+            if self.pos >= len(self.text) or self.text[self.pos] != ')':
+                raise QueryError("Missing closing parenthesis")
+            self.pos += 1
+            return node
+        if ch == '"':
+            return ("any", self.read_quoted(), True)
+
+        m = _WORD_RE.match(self.text, self.pos)
+        if not m:
+            raise QueryError(f"Unexpected {ch!r} at position {self.pos + 1}")
+        word = m.group(0)
+        self.pos = m.end()
+
+        op_m = _OP_RE.match(self.text, self.pos)
+        if not op_m:
+            return ("any", word, False)
+        column = _COLUMN_ALIASES.get(word.lower())
+        if column is None:
+            raise QueryError(f"Unknown column {word!r}")
+        self.pos = op_m.end()
+        op = op_m.group(1).lower()
+
+        self.skip_ws()
+        if self.pos < len(self.text) and self.text[self.pos] == '"':
+            value = self.read_quoted()
+        else:
+            v_m = _VALUE_RE.match(self.text, self.pos)
+            if not v_m:
+                raise QueryError(f"Missing value after {word}{op}")
+            value = v_m.group(0)
+            self.pos = v_m.end()
+        return ("clause", column, op, value)
+
+def _parse_number(column, value):
+    try:
+        return float(value)
+    except ValueError:
+        raise QueryError(f"{column} needs a number, got {value!r}") from None
+
+def _parse_time(value):
+    """Epoch ms (or seconds) or a local date/time string -> epoch ms."""
+    try:
+        number = float(value)
+        return number if number > 1e11 else number * 1000
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt).timestamp() * 1000
+        except ValueError:
+            continue
+    raise QueryError(f"Cannot read {value!r} as a time")
+
+_COMPARE = {"=": "==", "!=": "!=", ">": ">", ">=": ">=", "<": "<", "<=": "<="}
+
+class _QueryCompiler:
+    """Turns the AST into Python source plus a namespace of constants."""
+
+    def __init__(self):
+        self.consts = {}
+
+    def const(self, value):
+        name = f"c{len(self.consts)}"
+        self.consts[name] = value
+        return name
+
+    def compile(self, node):
+        """Returns (source, cost)."""
+        kind = node[0]
+        if kind in ("and", "or"):
+            parts = sorted((self.compile(n) for n in node[1]), key=lambda p: p[1])
+            joiner = f" {kind} "
+            return ("(" + joiner.join(p[0] for p in parts) + ")",
+                    sum(p[1] for p in parts))
+        if kind == "not":
+            src, cost = self.compile(node[1])
+            return f"(not {src})", cost
+        if kind == "any":
+            return self.compile_any(node[1], node[2])
+        return self.compile_clause(*node[1:])
+
+    def compile_any(self, value, exact):
+        c = self.const(value.lower())
+        if exact:
+            cells = ", ".join(f"r[{col!r}].lower()" for col in COLUMNS)
+            return f"({c} in ({cells}))", 8
+        return "(" + " or ".join(f"{c} in r[{col!r}].lower()" for col in COLUMNS) + ")", 9
+
+    def compile_clause(self, column, op, value):
+        ci = COLUMNS.index(column)
+        cell = f"r[{column!r}]"
+        key = f"k[{ci}]"
+
+        if op in ("~", "!~"):
+            import fnmatch
+            c = self.const(re.compile(fnmatch.translate(value), re.I))
+            neg = "not " if op == "!~" else ""
+            return f"({neg}{c}.match({cell}))", 5
+        if op == "contains":
+            c = self.const(value.lower())
+            return f"({c} in {cell}.lower())", 4
+
+        cmp = _COMPARE[op]
+        # inequality keeps most rows, so evaluate it after the selective ones
+        penalty = 1 if op == "!=" else 0
+
+        if column in _NUMERIC_COLUMNS:
+            # blank cells (e.g. NSG v1 counters) have the key -1 and never match
+            c = self.const(_parse_number(column, value))
+            return f"({key} >= 0 and {key} {cmp} {c})", 1 + penalty
+
+        if column in _IP_COLUMNS:
+            if '/' in value and op in ("=", "!="):
+                import ipaddress
+                try:
+                    net = ipaddress.ip_network(value, strict=False)
+                except ValueError:
+                    raise QueryError(f"Invalid network {value!r}") from None
+                lo = ip_sort_key(str(net.network_address))
+                hi = ip_sort_key(str(net.broadcast_address))
+                neg = "not " if op == "!=" else ""
+                return f"({neg}{self.const(lo)} <= {key} <= {self.const(hi)})", 2 + penalty
+            ip_key = ip_sort_key(value)
+            if ip_key < 0:
+                raise QueryError(f"Invalid IP address {value!r}")
+            return f"({key} {cmp} {self.const(ip_key)})", 1 + penalty
+
+        if column == "Timestamp":
+            if op in ("=", "!=") and not value.replace('.', '').isdigit():
+                # date/time prefix, e.g. Timestamp="2024-01-31 13"
+                neg = "not " if op == "!=" else ""
+                return f"({neg}{cell}.startswith({self.const(value)}))", 3 + penalty
+            return (f"({key} >= 0 and {key} {cmp} {self.const(_parse_time(value))})",
+                    1 + penalty)
+
+        if column in _CODE_MAPS:
+            mapping = _CODE_MAPS[column]
+            low = value.lower()
+            codes = {code for code, name in mapping.items()
+                     if low in (code.lower(), name.lower())} or {value}
+            if column == "proto":
+                try:
+                    codes = {int(code) for code in codes}
+                except ValueError:
+                    raise QueryError(f"Unknown protocol {value!r}") from None
+            else:
+                codes = {code.upper() for code in codes}
+            if op in ("=", "!="):
+                neg = "not " if op == "!=" else ""
+                return f"({key} {neg}in {self.const(frozenset(codes))})", 1 + penalty
+            return f"({key} {cmp} {self.const(next(iter(codes)))})", 1
+
+        # vnet / nsg / rule – keys are lower-cased names
+        return f"({key} {cmp} {self.const(value.lower())})", 1 + penalty
+
+def _required_literals(node):
+    """
+    Byte strings that must occur in a raw file for any row to match:
+    collected from the positive, top-level AND clauses on fields that are
+    written verbatim in the JSON (IPs and ports).
+    """
+    if node[0] == "and":
+        lits = []
+        for child in node[1]:
+            lits.extend(_required_literals(child))
+        return lits
+    if node[0] != "clause":
+        return []
+    _, column, op, value = node
+    if column in _IP_COLUMNS and op in ("=", "contains") and '/' not in value \
+            and ':' not in value:
+        if op == "=" and ip_sort_key(value) >= 0:
+            # the file holds the normalised address, e.g. 10.0.0.4 for 010.0.0.4
+            value = ".".join(str(int(part)) for part in value.split("."))
+        return [value.encode()]
+    if column in ("sourcePort", "destPort") and op == "=" and value.isdigit():
+        return [str(int(value)).encode()]
+    return []
+
+class CompiledQuery:
+    """
+    A parsed and compiled filter.  Call it with a row to test the row;
+    `may_match_bytes(raw)` is a cheap pre-check on a file's raw bytes that
+    returns False only when no row in the file can match.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        tree = _QueryParser(text).parse()
+        compiler = _QueryCompiler()
+        body, _ = compiler.compile(tree)
+        self.source = f"def _match(r):\n    k = r[{SORT_KEYS!r}]\n    return bool({body})\n"
+        namespace = dict(compiler.consts)
+        exec(compile(self.source, "<query>", "exec"), namespace)
+        self._match = namespace["_match"]
+        self.literals = _required_literals(tree)
+
+    def __call__(self, row):
+        return self._match(row)
+
+    def may_match_bytes(self, raw):
+        return all(lit in raw for lit in self.literals)
+
+    def filter_indices(self, rows, indices=None):
+        """Row indices (from `indices`, default all) that match."""
+        match = self._match
+        if indices is None:
+            return [i for i, r in enumerate(rows) if match(r)]
+        return [i for i in indices if match(rows[i])]
+
+@functools.lru_cache(maxsize=64)
+def compile_query(text):
+    """Parse and compile `text` once; repeated calls reuse the result."""
+    return CompiledQuery(text)
+
+def criteria_query(criteria):
+    """
+    Turn the Source / Destination / Port boxes ({column: value}) into query
+    text: a plain value is a substring match, a "quoted" value an exact one.
+    """
+    clauses = []
+    for column, value in criteria.items():
+        value = value.strip()
+        if not value:
+            continue
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            clauses.append(f"{column} = {quote_query_value(value[1:-1])}")
+        else:
+            clauses.append(f"{column} contains {quote_query_value(value)}")
+    return " and ".join(clauses)
+
+def combine_queries(*texts):
+    """AND together query strings, ignoring empty ones."""
+    parts = [t.strip() for t in texts if t and t.strip()]
+    if len(parts) <= 1:
+        return parts[0] if parts else ""
+    return " and ".join(f"({t})" for t in parts)
+
+# ----------------------------------------------------------------------
+# Inverted index for the as-you-type row filter
+# ----------------------------------------------------------------------
+INDEX_FIELDS = ("sourceIP", "destIP", "destPort")
+FILTER_DEBOUNCE_MS = 200
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class RowIndex:
+    """
+    Inverted index over one window's rows for the sourceIP / destIP /
+    destPort filter fields.
+
+    Every distinct (lower-cased) value maps to the posting list of row ids
+    that carry it, and every trigram maps to the distinct values containing
+    it.  A substring query is answered by intersecting the trigram sets,
+    checking the few surviving values and merging their posting lists.
+    When a query extends the previous one for the same field, only the
+    values that matched last time are re-checked.
+    """
+
+    def __init__(self, rows, fields=INDEX_FIELDS):
+        self.fields = fields
+        self.postings = {f: {} for f in fields}   # field -> value -> [row ids]
+        self.grams = {f: {} for f in fields}      # field -> trigram -> {values}
+        self._last = {}                           # field -> (query, [values])
+
+        for i, row in enumerate(rows):
+            for f in fields:
+                self.postings[f].setdefault(str(row.get(f, '')).lower(), []).append(i)
+
+        for f in fields:
+            grams = self.grams[f]
+            for value in self.postings[f]:
+                for g in _trigrams(value):
+                    grams.setdefault(g, set()).add(value)
+
+    def matching_values(self, field, query):
+        """Distinct values of `field` that contain `query` (lower-case)."""
+        last = self._last.get(field)
+        if last is not None and last[0] and last[0] in query:
+            candidates = last[1]                  # narrow the previous result
+        elif len(query) >= 3:
+            gram_sets = sorted((self.grams[field].get(g, set())
+                                for g in _trigrams(query)), key=len)
+            candidates = set.intersection(*gram_sets) if gram_sets else set()
+        else:
+            candidates = self.postings[field].keys()
+
+        matched = [v for v in candidates if query in v]
+        self._last[field] = (query, matched)
+        return matched
+
+    def lookup(self, field, query):
+        """
+        Set of row ids whose `field` contains `query` (case-insensitive);
+        a "quoted" query must match the whole value.
+        """
+        postings = self.postings[field]
+        if len(query) >= 2 and query[0] == query[-1] == '"':
+            return set(postings.get(query[1:-1].lower(), ()))
+        rows = set()
+        for value in self.matching_values(field, query.lower()):
+            rows.update(postings[value])
+        return rows
+
+    def search(self, criteria):
+        """
+        `criteria` is {field: query}; empty queries are ignored.
+        Returns the sorted row ids matching all of them (AND), or None
+        when there is nothing to filter on.
+        """
+        sets = [self.lookup(f, q) for f, q in criteria.items() if q]
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = sets[0].intersection(*sets[1:])
+        return sorted(result)
+
+# ----------------------------------------------------------------------
+# Flow session stitching
+# ----------------------------------------------------------------------
+# vNet flow logs report the same 5-tuple several times: B (Begin), then
+# C (Continuing) rows carrying counter deltas, then E (End).  D (Deny)
+# tuples are single denied attempts.
+SESSION_COLUMNS = [
+    "start", "end", "durationSec", "sourceIP", "destIP", "sourcePort",
+    "destPort", "proto", "nsg", "rule", "tuples", "packets", "bytes",
+    "finalState"
+]
+MAX_OPEN_SESSIONS = 200000   # open sessions held before the stalest is flushed
+
+_TS_COL = COLUMNS.index("Timestamp")
+_STATE_COL = COLUMNS.index("flowState")
+_COUNTER_COLS = [COLUMNS.index(c) for c in ("packetsSrcToDest", "bytesSrcToDest",
+                                            "packetsDstToSrc", "bytesDestToSrc")]
+
+def _format_epoch_ms(epoch_ms):
+    if epoch_ms < 0:
+        return ""
+    return datetime.datetime.fromtimestamp(epoch_ms / 1000).strftime('%Y-%m-%d %H:%M:%S')
+
+def _close_session(key, s):
+    start, end = s[0], s[1]
+    return {
+        "start": _format_epoch_ms(start),
+        "end": _format_epoch_ms(end),
+        "durationSec": max(0, end - start) // 1000,
+        "sourceIP": key[0], "destIP": key[1],
+        "sourcePort": key[2], "destPort": key[3], "proto": key[4],
+        "nsg": s[6], "rule": s[7],
+        "tuples": s[2], "packets": s[3], "bytes": s[4],
+        "finalState": flow_state_map.get(s[5], s[5]),
+    }
+
+def stitch_sessions(rows, max_open=MAX_OPEN_SESSIONS):
+    """
+    Join flow rows into sessions in a single streaming pass.
+
+    `rows` must arrive in (roughly) timestamp order.  Sessions are keyed on
+    (sourceIP, destIP, sourcePort, destPort, proto) in a hash table; a
+    session is emitted as soon as its E or D tuple is seen, and when more
+    than `max_open` sessions are open the least recently updated one is
+    flushed, so memory stays bounded.  Sessions still open at the end are
+    emitted with their last state.  Yields dicts keyed by SESSION_COLUMNS.
+    """
+    open_sessions = OrderedDict()   # key -> [start, end, tuples, pkts, bytes, state, nsg, rule]
+    for row in rows:
+        keys = row[SORT_KEYS]
+        key = (row["sourceIP"], row["destIP"], row["sourcePort"],
+               row["destPort"], row["proto"])
+        ts = keys[_TS_COL]
+        state = keys[_STATE_COL]
+        p1, b1, p2, b2 = (max(0, keys[c]) for c in _COUNTER_COLS)
+
+        s = open_sessions.get(key)
+        if s is not None and state == "B":
+            # A new Begin without an End – the previous session is over
+            yield _close_session(key, open_sessions.pop(key))
+            s = None
+        if s is None:
+            s = [ts, ts, 0, 0, 0, state, row["nsg"], row["rule"]]
+            open_sessions[key] = s
+        else:
+            open_sessions.move_to_end(key)
+        s[1] = max(s[1], ts)
+        s[2] += 1
+        s[3] += p1 + p2
+        s[4] += b1 + b2
+        s[5] = state
+
+        if state in ("E", "D"):
+            yield _close_session(key, open_sessions.pop(key))
+        elif len(open_sessions) > max_open:
+            old_key, old = open_sessions.popitem(last=False)
+            yield _close_session(old_key, old)
+
+    for key, s in open_sessions.items():
+        yield _close_session(key, s)
+
+def _row_ts(row):
+    return row[SORT_KEYS][_TS_COL]
+
+_TUPLE_SECONDS_RE = re.compile(rb'"(\d{10}),')     # NSG flow log tuples
+_TUPLE_MILLIS_RE = re.compile(rb'"(\d{13}),')      # vNet flow log tuples
+
+def first_tuple_timestamp(raw):
+    """
+    Earliest tuple timestamp (epoch ms) in the raw JSON of one flow log,
+    found by scanning the bytes instead of decoding them; -1 if none.
+    """
+    firsts = [min(map(int, _TUPLE_MILLIS_RE.findall(raw)), default=None),
+              min((int(s) * 1000 for s in _TUPLE_SECONDS_RE.findall(raw)), default=None)]
+    return min((ts for ts in firsts if ts is not None), default=-1)
+
+def iter_rows_by_time(sources):
+    """
+    Merge several files' rows into one stream in timestamp order.
+
+    `sources` are `(first_ts, load)` pairs: a lower bound of the file's
+    earliest timestamp (epoch ms) and a function returning its rows.  Files
+    are loaded in order of `first_ts`, only once the merge has reached that
+    time, and each one is sorted on its own and dropped as soon as it has
+    been handed out.  So only the files whose time ranges overlap the
+    current position are resident, and files that overlap still
+    interleave correctly.
+    """
+    pending = sorted(sources, key=operator.itemgetter(0))
+    pending.reverse()                   # next file to open at the end
+    heap, seq = [], itertools.count()   # (ts, seq, row, rest of its file)
+
+    def push(run):
+        row = next(run, None)
+        if row is not None:
+            heapq.heappush(heap, (_row_ts(row), next(seq), row, run))
+
+    def sorted_rows(rows):
+        run = sorted(rows, key=_row_ts)
+        del rows
+        run.reverse()
+        while run:
+            yield run.pop()
+
+    while pending or heap:
+        if pending and (not heap or pending[-1][0] <= heap[0][0]):
+            push(sorted_rows(pending.pop()[1]()))
+            continue
+        _, _, row, run = heapq.heappop(heap)
+        yield row
+        push(run)
+
+def table_sort_key(col, value):
+    """
+    Typed sort key for one cell of a derived table (sessions, comparisons):
+    IPs as integers, ports and counters as numbers, everything else as
+    case-folded text.
+    """
+    if col in _IP_COLUMNS:
+        return ip_sort_key(value)
+    if col in ("sourcePort", "destPort"):
+        return _int_key(value)
+    if isinstance(value, (int, float)):
+        return (0, value, "")
+    return (1, 0, str(value).lower())
+
+# ----------------------------------------------------------------------
+# Hourly rollups
+# ----------------------------------------------------------------------
+_DIR_COL = COLUMNS.index("trafficFlow")
+
+def compute_rollups(rows):
+    """
+    Per-hour totals of one file's rows, grouped by flowState, nsg, rule and
+    direction: {hour epoch s (str): [[state, nsg, rule, dir, tuples, bytes, packets], …]}.
+    """
+    groups = {}
+    for row in rows:
+        keys = row[SORT_KEYS]
+        ts = keys[_TS_COL]
+        if ts < 0:
+            continue
+        hour = ts // 3600000 * 3600
+        key = (hour, keys[_STATE_COL], row["nsg"], row["rule"], keys[_DIR_COL])
+        p1, b1, p2, b2 = (max(0, keys[c]) for c in _COUNTER_COLS)
+        acc = groups.get(key)
+        if acc is None:
+            groups[key] = [1, b1 + b2, p1 + p2]
+        else:
+            acc[0] += 1
+            acc[1] += b1 + b2
+            acc[2] += p1 + p2
+
+    hours = {}
+    for (hour, state, nsg, rule, direction), (tuples, nbytes, packets) in groups.items():
+        hours.setdefault(str(hour), []).append(
+            [state, nsg, rule, direction, tuples, nbytes, packets])
+    return hours
+
+def overview_totals(rollups, nsg=None):
+    """
+    Aggregate the rollup catalog.  Returns (per_hour, per_group) where
+    per_hour is {hour epoch s: [tuples, denies, bytes, packets, {sources}]}
+    and per_group is {(nsg, rule): [tuples, denies, bytes, packets]}.
+    Only rows of `nsg` are counted when it is given.
+    """
+    per_hour, per_group = {}, {}
+    for source, entry in rollups.get("files", {}).items():
+        for hour, groups in entry.get("hours", {}).items():
+            for state, g_nsg, rule, _, tuples, nbytes, packets in groups:
+                if nsg and g_nsg != nsg:
+                    continue
+                deny = tuples if state == "D" else 0
+                h = per_hour.setdefault(int(hour), [0, 0, 0, 0, set()])
+                h[0] += tuples
+                h[1] += deny
+                h[2] += nbytes
+                h[3] += packets
+                h[4].add(source)
+                g = per_group.setdefault((g_nsg, rule), [0, 0, 0, 0])
+                g[0] += tuples
+                g[1] += deny
+                g[2] += nbytes
+                g[3] += packets
+    return per_hour, per_group
+
+# ----------------------------------------------------------------------
+# Timeline: rows ordered by time with running totals
+# ----------------------------------------------------------------------
+class TimeIndex:
+    """
+    The timestamped rows of one dataset sorted by time, plus running
+    totals of bytes and denied tuples.  A time range maps to a slice of
+    `perm` with two binary searches, and any bin of a histogram costs two
+    lookups in the running totals – so zooming only touches the bins on
+    screen, never the rows.
+    """
+
+    def __init__(self, rows):
+        stamped = [(r[SORT_KEYS][_TS_COL], i) for i, r in enumerate(rows)
+                   if SORT_KEYS in r and r[SORT_KEYS][_TS_COL] >= 0]
+        stamped.sort()
+        self.times = [t for t, _ in stamped]
+        self.perm = [i for _, i in stamped]
+
+        cum_bytes, cum_denies = [0], [0]
+        nbytes = denies = 0
+        for i in self.perm:
+            keys = rows[i][SORT_KEYS]
+            nbytes += max(0, keys[_COUNTER_COLS[1]]) + max(0, keys[_COUNTER_COLS[3]])
+            denies += keys[_STATE_COL] == "D"
+            cum_bytes.append(nbytes)
+            cum_denies.append(denies)
+        self.cum_bytes = cum_bytes
+        self.cum_denies = cum_denies
+
+    def __len__(self):
+        return len(self.times)
+
+    def span(self):
+        """(first, last + 1) epoch ms, or None without timestamps."""
+        if not self.times:
+            return None
+        return self.times[0], self.times[-1] + 1
+
+    def range_indices(self, lo, hi):
+        """Row indices with lo <= timestamp < hi, in time order."""
+        a = bisect.bisect_left(self.times, lo)
+        b = bisect.bisect_left(self.times, hi)
+        return self.perm[a:b]
+
+    def histogram(self, lo, hi, nbins):
+        """
+        Split [lo, hi) into `nbins` equal bins; returns a list of
+        (bin start ms, tuples, bytes, denied tuples).
+        """
+        width = (hi - lo) / nbins
+        edges = [bisect.bisect_left(self.times, lo + k * width)
+                 for k in range(nbins)]
+        edges.append(bisect.bisect_left(self.times, hi))
+        cb, cd = self.cum_bytes, self.cum_denies
+        return [(lo + k * width, b - a, cb[b] - cb[a], cd[b] - cd[a])
+                for k, (a, b) in enumerate(zip(edges, edges[1:]))]
+
+# ----------------------------------------------------------------------
+# Compare two sets of flows (files or time ranges)
+# ----------------------------------------------------------------------
+COMPARE_KEY = ("sourceIP", "destIP", "destPort", "proto")
+COMPARE_COLUMNS = [
+    "change", "sourceIP", "destIP", "destPort", "proto",
+    "tuplesA", "tuplesB", "bytesA", "bytesB", "deltaBytes"
+]
+COMPARE_MEMORY_KEYS = 500000   # keys per side held in memory before spilling
+COMPARE_PARTITIONS = 64        # hash partitions of a spilled side
+COMPARE_CHANGE_FACTOR = 2.0    # volume ratio reported as "changed"
+COMPARE_MAX_RESULTS = 20000    # largest differences listed
+
+class FlowKeyCounter:
+    """
+    Tuples and bytes per flow key for one side of a comparison.  At most
+    `max_keys` keys are held in memory; beyond that the counts are
+    appended to `partitions` files in `spill_dir`, chosen by a CRC32 of
+    the key, so both sides can later be compared one partition at a time.
+    """
+
+    def __init__(self, name, spill_dir, max_keys=COMPARE_MEMORY_KEYS,
+                 partitions=COMPARE_PARTITIONS):
+        self.name = name
+        self.spill_dir = spill_dir
+        self.max_keys = max_keys
+        self.partitions = partitions
+        self.counts = {}
+        self.spilled = False
+
+    def add(self, key, nbytes):
+        acc = self.counts.get(key)
+        if acc is None:
+            self.counts[key] = [1, nbytes]
+            if len(self.counts) > self.max_keys:
+                self.spill()
+        else:
+            acc[0] += 1
+            acc[1] += nbytes
+
+    def _path(self, partition):
+        return os.path.join(self.spill_dir, f"{self.name}-{partition:03d}.tsv")
+
+    def spill(self):
+        """Append the in-memory counts to the partition files and drop them."""
+        files = {}
+        try:
+            for key, (tuples, nbytes) in self.counts.items():
+                line = "\t".join(key)
+                p = zlib.crc32(line.encode()) % self.partitions
+                f = files.get(p)
+                if f is None:
+                    f = files[p] = open(self._path(p), "a", encoding="utf-8")
+                f.write(f"{line}\t{tuples}\t{nbytes}\n")
+        finally:
+            for f in files.values():
+                f.close()
+        self.counts.clear()
+        self.spilled = True
+
+    def load_partition(self, partition):
+        """Counts of one spilled partition, with repeated keys merged."""
+        counts = {}
+        path = self._path(partition)
+        if not os.path.exists(path):
+            return counts
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                *key, tuples, nbytes = line.rstrip("\n").split("\t")
+                key = tuple(key)
+                acc = counts.get(key)
+                if acc is None:
+                    counts[key] = [int(tuples), int(nbytes)]
+                else:
+                    acc[0] += int(tuples)
+                    acc[1] += int(nbytes)
+        return counts
+
+def count_flow_keys(rows, counter, lo=None, hi=None):
+    """Add `rows` (only those with lo <= timestamp < hi, if given) to `counter`."""
+    b1, b2 = _COUNTER_COLS[1], _COUNTER_COLS[3]
+    for row in rows:
+        keys = row[SORT_KEYS]
+        if lo is not None and not lo <= keys[_TS_COL] < hi:
+            continue
+        counter.add(tuple(row[c] for c in COMPARE_KEY),
+                    max(0, keys[b1]) + max(0, keys[b2]))
+
+def count_flow_key_tuples(text, counter, lo=None, hi=None):
+    """
+    count_flow_keys straight from the JSON text of one file: records are
+    decoded one at a time and their tuples counted from the split fields,
+    without building rows, sort keys or column statistics.
+    """
+    proto_text = _PROTO_TEXT
+    fmt = None
+    for record, _ in iter_json_records(text):
+        if fmt is None:
+            fmt = detect_format(record)
+            if fmt is None:
+                continue
+        for f, _, _, _ in TUPLE_FIELDS[fmt]([record]):
+            if len(f) != 13:
+                continue
+            if lo is not None and not lo <= _int_key(f[0]) < hi:
+                continue
+            counter.add((f[1], f[2], f[4], proto_text.get(f[5], f[5])),
+                        max(0, _int_key(f[10])) + max(0, _int_key(f[12])))
+
+def compare_flow_keys(side_a, side_b, factor=COMPARE_CHANGE_FACTOR,
+                      limit=COMPARE_MAX_RESULTS):
+    """
+    Compare two FlowKeyCounters, A being the baseline.  Returns
+    (summary, rows): summary counts the new / gone / changed / unchanged
+    keys, rows are the `limit` largest differences as COMPARE_COLUMNS dicts.
+    A key has changed when its bytes (tuples for byte-less flows) differ
+    by more than `factor` in either direction.
+    """
+    if side_a.spilled or side_b.spilled:
+        side_a.spill()
+        side_b.spill()
+        pairs = ((side_a.load_partition(p), side_b.load_partition(p))
+                 for p in range(side_a.partitions))
+    else:
+        pairs = [(side_a.counts, side_b.counts)]
+
+    summary = {"new": 0, "gone": 0, "changed": 0, "unchanged": 0}
+    heap, seq = [], itertools.count()
+    for counts_a, counts_b in pairs:
+        for key in counts_a.keys() | counts_b.keys():
+            ta, ba = counts_a.get(key, (0, 0))
+            tb, bb = counts_b.get(key, (0, 0))
+            if not ta:
+                change = "new"
+            elif not tb:
+                change = "gone"
+            else:
+                va, vb = (ba, bb) if ba or bb else (ta, tb)
+                if max(va, vb) <= factor * max(1, min(va, vb)):
+                    summary["unchanged"] += 1
+                    continue
+                change = "changed"
+            summary[change] += 1
+            item = (abs(bb - ba) or abs(tb - ta), next(seq), change, key, ta, tb, ba, bb)
+            if len(heap) < limit:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+
+    rows = []
+    for _, _, change, key, ta, tb, ba, bb in sorted(heap, reverse=True):
+        row = dict(zip(COMPARE_KEY, key))
+        row.update(change=change, tuplesA=ta, tuplesB=tb,
+                   bytesA=ba, bytesB=bb, deltaBytes=bb - ba)
+        rows.append(row)
+    return summary, rows
+
 # Extract vnet name from targetResourceID
 def extract_vnet(record):
-    target_id = record.get("targetResourceID", "")
+    return _vnet_name(record.get("targetResourceID", ""))
+
+@functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)
+def _vnet_name(target_id):
     if "/virtualNetworks/" in target_id:
-        return target_id.split("/virtualNetworks/")[1].split("/")[0]
+        return _intern(target_id.split("/virtualNetworks/")[1].split("/")[0])
     return ""
 
-# Extract NSG name from aclID
+# Extract NSG name from aclID (memoised: one aclID serves many flows)
+@functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)
 def extract_nsg(acl_id):
     if acl_id == "00000000-0000-0000-0000-000000000000":
         return "MSPlatformNSG"
     if "/networkSecurityGroups/" in acl_id:
-        return acl_id.split("/networkSecurityGroups/")[1].split("/")[0]
+        return _intern(acl_id.split("/networkSecurityGroups/")[1].split("/")[0])
     return ""
 
+# Case-insensitive name lookup in an ARM resource ID (NSG flow logs use
+# upper-case IDs such as .../NETWORKSECURITYGROUPS/MY-NSG)
+@functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)
+def _resource_name(resource_id, kind):
+    marker = f"/{kind}/"
+    pos = resource_id.lower().find(marker)
+    if pos < 0:
+        return ""
+    return _intern(resource_id[pos + len(marker):].split("/")[0])
+
+# Display text of the coded columns, e.g. "6" -> "6 (TCP)"; one shared
+# string per code, unknown codes are shown as they are
+def _code_texts(mapping):
+    return {code: f"{code} ({name})" for code, name in mapping.items()}
+
+_PROTO_TEXT = _code_texts(proto_map)
+_FLOW_TEXT = _code_texts(traffic_flow_map)
+_STATE_TEXT = _code_texts(flow_state_map)
+_ENCRYPTION_TEXT = _code_texts(encryption_map)
+
+@functools.lru_cache(maxsize=SYMBOL_CACHE_SIZE)
+def _second_text(seconds):
+    return datetime.datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+def _timestamp_text(value):
+    """Epoch ms -> local 'YYYY-MM-DD HH:MM:SS' (the original string on error)."""
+    try:
+        return _second_text(int(value) // 1000)   # assume milliseconds
+    except (ValueError, OverflowError, OSError):
+        return value
+
+# Function to map flow tuple fields to their proper names and values
+def map_flow_tuple(fields):
+    """Row dict (keys of `tuple_fields`) for one split 13-field tuple."""
+    if len(fields) != 13:
+        return {}
+
+    ts, src, dst, sport, dport, proto, flow, state, enc, p1, b1, p2, b2 = fields
+    return {
+        "Timestamp": _timestamp_text(ts),
+        "sourceIP": src,
+        "destIP": dst,
+        "sourcePort": sport,
+        "destPort": dport,
+        "proto": _PROTO_TEXT.get(proto, proto),
+        "trafficFlow": _FLOW_TEXT.get(flow, flow),
+        "flowState": _STATE_TEXT.get(state, state),
+        "encryption": _ENCRYPTION_TEXT.get(enc, enc),
+        "packetsSrcToDest": p1,
+        "bytesSrcToDest": b1,
+        "packetsDstToSrc": p2,
+        "bytesDestToSrc": b2,
+    }
+
+# ----------------------------------------------------------------------
+# Flow log formats
+# ----------------------------------------------------------------------
+# vNet flow logs:  records[].flowRecords.flows[].flowGroups[].flowTuples,
+#                  13-field tuples, epoch ms (the row schema used throughout)
+# NSG flow logs:   records[].properties.flows[].flows[].flowTuples
+#     Version 1 –  8 fields:  ts(s),src,dst,sport,dport,T/U,I/O,A/D
+#     Version 2 – 13 fields:  ts(s),src,dst,sport,dport,T/U,I/O,A/D,B/C/E,
+#                             packets/bytes src→dst, packets/bytes dst→src
+# Each format has its own decoder mapping tuples onto the vNet 13-field
+# layout, so the format is decided once per file, never per tuple.
+FORMAT_VNET = "vnet"
+FORMAT_NSG_V1 = "nsg-v1"
+FORMAT_NSG_V2 = "nsg-v2"
+
+_NSG_PROTO = {"T": "6", "U": "17"}
+
+def detect_format(record):
+    """Flow log format of a record (FORMAT_*), or None if unrecognised."""
+    if 'flowRecords' in record:
+        return FORMAT_VNET
+    props = record.get('properties')
+    if isinstance(props, dict) and 'flows' in props:
+        try:
+            version = int(props.get('Version', 1))
+        except (TypeError, ValueError):
+            version = 1
+        return FORMAT_NSG_V2 if version >= 2 else FORMAT_NSG_V1
+    return None
+
+def _emit(fields, vnet, nsg, rule, out):
+    if len(fields) != 13:
+        return
+    # rows share one string per IP, port and code; timestamps and counters
+    # are near-unique, so interning them would only grow the intern table
+    fields[1:9] = map(_intern, fields[1:9])
+    row = map_flow_tuple(fields)
+    if row:
+        rule = _intern(rule)
+        row['vnet'] = vnet
+        row['nsg'] = nsg
+        row['rule'] = rule
+        row[SORT_KEYS] = make_sort_keys(fields, vnet, nsg, rule)
+        out.append(row)
+
+def _iter_vnet_fields(records):
+    """(split tuple, vnet, nsg, rule) for every vNet flow log tuple."""
+    for r in records:
+        if 'flowRecords' not in r or 'flows' not in r['flowRecords']:
+            continue
+        vnet_name = extract_vnet(r)
+        for flow in r['flowRecords']['flows']:
+            nsg_name = extract_nsg(flow.get('aclID', ''))
+            for group in flow.get('flowGroups', []):
+                rule_name = group.get('rule', '')
+                for tup in group.get('flowTuples', []):
+                    yield tup.split(','), vnet_name, nsg_name, rule_name
+
+def _iter_nsg_tuples(records):
+    """(nsg name, rule name, tuple string) for every NSG flow log tuple."""
+    for r in records:
+        props = r.get('properties')
+        if not isinstance(props, dict):
+            continue
+        nsg_name = _resource_name(r.get('resourceId', ''), 'networksecuritygroups')
+        for rule_flow in props.get('flows', []):
+            rule_name = rule_flow.get('rule', '')
+            for mac_flow in rule_flow.get('flows', []):
+                for tup in mac_flow.get('flowTuples', []):
+                    yield nsg_name, rule_name, tup
+
+def _nsg_v1_fields(f):
+    """8 split NSG v1 tuple fields -> the vNet 13-field layout."""
+    ts = f"{f[0]}000" if f[0].isdigit() else f[0]
+    return [ts, f[1], f[2], f[3], f[4], _NSG_PROTO.get(f[5], f[5]), f[6],
+            "D" if f[7] == "D" else "A", "", "", "", "", ""]
+
+def _nsg_v2_fields(f):
+    """13 split NSG v2 tuple fields -> the vNet 13-field layout."""
+    ts = f"{f[0]}000" if f[0].isdigit() else f[0]
+    return [ts, f[1], f[2], f[3], f[4], _NSG_PROTO.get(f[5], f[5]), f[6],
+            "D" if f[7] == "D" else f[8], "", f[9], f[10], f[11], f[12]]
+
+def _iter_nsg_v1_fields(records):
+    for nsg_name, rule_name, tup in _iter_nsg_tuples(records):
+        f = tup.split(',')
+        if len(f) == 8:
+            yield _nsg_v1_fields(f), "", nsg_name, rule_name
+
+def _iter_nsg_v2_fields(records):
+    for nsg_name, rule_name, tup in _iter_nsg_tuples(records):
+        f = tup.split(',')
+        if len(f) == 13:
+            yield _nsg_v2_fields(f), "", nsg_name, rule_name
+
+# Per format: (tuple fields in the vNet 13-field layout, vnet, nsg, rule)
+# for every tuple of a list of records
+TUPLE_FIELDS = {
+    FORMAT_VNET: _iter_vnet_fields,
+    FORMAT_NSG_V1: _iter_nsg_v1_fields,
+    FORMAT_NSG_V2: _iter_nsg_v2_fields,
+}
+
+def decode_vnet_records(records, out):
+    for fields, vnet, nsg, rule in _iter_vnet_fields(records):
+        _emit(fields, vnet, nsg, rule, out)
+
+def decode_nsg_v1_records(records, out):
+    for fields, vnet, nsg, rule in _iter_nsg_v1_fields(records):
+        _emit(fields, vnet, nsg, rule, out)
+
+def decode_nsg_v2_records(records, out):
+    for fields, vnet, nsg, rule in _iter_nsg_v2_fields(records):
+        _emit(fields, vnet, nsg, rule, out)
+
+DECODERS = {
+    FORMAT_VNET: decode_vnet_records,
+    FORMAT_NSG_V1: decode_nsg_v1_records,
+    FORMAT_NSG_V2: decode_nsg_v2_records,
+}
+
+def parse_records(records, stats=None, fmt=None):
+    """
+    Convert raw `records` of one file into rows (normalised to COLUMNS).
+    The format is detected from the first record unless `fmt` is given.
+    If a ColumnStats is supplied it is updated with every row produced.
+    """
+    if fmt is None:
+        fmt = next((f for f in map(detect_format, records) if f), None)
+    out = []
+    decoder = DECODERS.get(fmt)
+    if decoder is not None:
+        decoder(records, out)
+    if stats is not None:
+        stats.add_rows(out)
+    return out
+
+# ----------------------------------------------------------------------
+# Sampled preview of large files
+# ----------------------------------------------------------------------
+# A multi-GB file takes a while to parse in full.  Until it is, the data
+# window shows the tuples found in byte ranges spread evenly over the
+# file.  Tuples are recognised by their shape (13 fields with an epoch-ms
+# timestamp = vNet, 13 with epoch seconds = NSG v2, 8 = NSG v1); their
+# rule / NSG / vNet come from the nearest preceding keys, which a short
+# look-back before each range usually covers.
+PREVIEW_MIN_BYTES = 64 << 20     # plain .json files from this size get a preview
+PREVIEW_RANGES = 64              # byte ranges sampled per file
+PREVIEW_RANGE_BYTES = 256 << 10  # bytes read per range
+PREVIEW_LOOKBACK = 64 << 10      # bytes read before a range for its context
+PREVIEW_TOP_VALUES = 3
+PREVIEW_SUMMARY_COLUMNS = ("sourceIP", "destIP", "destPort", "proto",
+                           "flowState", "rule")
+
+_SAMPLE_RE = re.compile(
+    rb'"(rule|aclID|targetResourceID|resourceId)"\s*:\s*"([^"]*)"'
+    rb'|"(\d{10,13},[^"]*)"')
+
+def _decode_sample(data, start, out):
+    """Decode the tuples of `data` found at or after offset `start`."""
+    context = {}
+    for m in _SAMPLE_RE.finditer(data):
+        if m.group(1) is not None:
+            context[m.group(1)] = m.group(2).decode('utf-8', 'replace')
+            continue
+        if m.start() < start:
+            continue
+        f = m.group(3).decode('ascii', 'replace').split(',')
+        rule = context.get(b'rule', '')
+        if len(f) == 13 and len(f[0]) == 13:
+            vnet = extract_vnet({"targetResourceID": context.get(b'targetResourceID', '')})
+            _emit(f, vnet, extract_nsg(context.get(b'aclID', '')), rule, out)
+        elif len(f) in (8, 13):
+            nsg = _resource_name(context.get(b'resourceId', ''), 'networksecuritygroups')
+            fields = _nsg_v1_fields(f) if len(f) == 8 else _nsg_v2_fields(f)
+            _emit(fields, "", nsg, rule, out)
+
+def sample_flow_log(path, ranges=PREVIEW_RANGES, range_bytes=PREVIEW_RANGE_BYTES):
+    """
+    Rows decoded from `ranges` byte ranges spread evenly over the plain
+    .json file `path`.  Returns (rows, estimated rows in the whole file).
+    """
+    size = os.path.getsize(path)
+    stride = size / ranges
+    range_bytes = min(range_bytes, int(stride)) or size
+    rows, sampled = [], 0
+    with open(path, 'rb') as f:
+        for k in range(ranges):
+            start = int(k * stride)
+            begin = max(0, start - PREVIEW_LOOKBACK)
+            f.seek(begin)
+            data = f.read(start - begin + range_bytes)
+            sampled += len(data) - (start - begin)
+            _decode_sample(data, start - begin, rows)
+    estimated = int(len(rows) * size / sampled) if sampled else 0
+    return rows, estimated
+
+def top_values(rows, columns=PREVIEW_SUMMARY_COLUMNS, n=PREVIEW_TOP_VALUES):
+    """{column: [(value, share of rows), …]} for the `n` commonest values."""
+    total = len(rows) or 1
+    return {col: [(value, count / total)
+                  for value, count in Counter(r[col] for r in rows).most_common(n)]
+            for col in columns}
+
+# ----------------------------------------------------------------------
+# Headless rule watcher (--watch)
+# ----------------------------------------------------------------------
+# Polls a folder for new or grown flow logs and evaluates every saved rule
+# on the new records only.  A checkpoint per source remembers its mtime,
+# size and how far it was processed: the byte offset after the last
+# complete record for plain .json files (blobs grow by appended records),
+# the record count for compressed sources, which are re-read but not
+# re-evaluated.  Hits are appended to a JSON Lines file.
+CHECKPOINT_FILE = "flowwatch.checkpoint.json"
+WATCH_INTERVAL_SEC = 60
+_UTF8_BOM = b'\xef\xbb\xbf'
+
+def _load_checkpoints(path) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_checkpoints(path, checkpoints) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoints, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def compile_rules(rules):
+    """{name: query} -> [(name, CompiledQuery)]; bad queries raise QueryError."""
+    compiled = []
+    for name, text in sorted(rules.items()):
+        try:
+            compiled.append((name, compile_query(text)))
+        except QueryError as e:
+            raise QueryError(f"rule {name!r}: {e}") from None
+    return compiled
+
+def _read_new_records(source, checkpoint):
+    """
+    The raw new bytes of `source` and an iterator of `(record, offset)`
+    for the records not yet processed.  Offsets are byte offsets into the
+    file for plain .json files, record counts otherwise.
+    """
+    path, member = split_source(source)
+    offset = checkpoint.get("offset", 0)
+    if member is None and not path.lower().endswith('.gz'):
+        with open(path, 'rb') as f:
+            if offset:
+                f.seek(offset)
+            raw = f.read()
+        base = offset
+        if not offset and raw.startswith(_UTF8_BOM):
+            base = len(_UTF8_BOM)
+            raw = raw[base:]
+        text = raw.decode('utf-8')
+        ascii_only = text.isascii()
+
+        def records():
+            # character offsets -> byte offsets, encoding only the text
+            # since the previous record instead of the whole prefix again
+            prev_end = size = 0
+            for record, end in iter_json_records(text, start=0 if offset else None):
+                if ascii_only:
+                    size = end
+                else:
+                    size += len(text[prev_end:end].encode('utf-8'))
+                    prev_end = end
+                yield record, base + size
+        return raw, records()
+
+    raw = read_flow_log_bytes(source)
+    text = raw.decode('utf-8-sig')
+    skip = checkpoint.get("records", 0)
+
+    def records():
+        for n, (record, _) in enumerate(iter_json_records(text), 1):
+            if n > skip:
+                yield record, n
+    return raw, records()
+
+def watch_source(source, checkpoint, rules, emit):
+    """
+    Evaluate `rules` on the records of `source` added since `checkpoint`
+    (updated in place) and call `emit(name, row)` per hit.  Rules whose
+    required literals are absent from the new bytes are skipped, and the
+    records are not even decoded into rows when no rule is left.
+    Returns the number of new records.
+    """
+    raw, records = _read_new_records(source, checkpoint)
+    live = [(name, q) for name, q in rules if q.may_match_bytes(raw)]
+    del raw
+    plain = "offset" in checkpoint
+    fmt = checkpoint.get("fmt")
+    count = 0
+    try:
+        for record, position in records:
+            if fmt is None:
+                fmt = detect_format(record)
+            if live:
+                for row in parse_records([record], fmt=fmt):
+                    for name, query in live:
+                        if query(row):
+                            emit(name, row)
+            checkpoint["offset" if plain else "records"] = position
+            count += 1
+    except json.JSONDecodeError:
+        pass                    # a record still being written – next round
+    checkpoint["fmt"] = fmt
+    return count
+
+def watch_once(top, rules, checkpoints, emit):
+    """One scan of `top`; returns (sources processed, new records)."""
+    sources = records = 0
+    for source, _ in iter_flow_log_files(top):
+        try:
+            mtime_ns, size, member = source_signature(source)
+        except OSError:
+            continue
+        cp = checkpoints.get(source)
+        if cp is not None and cp["mtime_ns"] == mtime_ns and cp["size"] == size:
+            continue
+        plain = member is None and not source.lower().endswith('.gz')
+        if cp is None or size < cp["size"]:
+            # new, or rewritten shorter: start from the beginning
+            cp = {"offset": 0} if plain else {"records": 0}
+        try:
+            records += watch_source(source, cp, rules, emit)
+        except (OSError, ValueError) as e:
+            print(f"{source}: {e}", file=sys.stderr)
+            continue
+        cp["mtime_ns"], cp["size"] = mtime_ns, size
+        checkpoints[source] = cp
+        sources += 1
+    return sources, records
+
+def run_watch(top, rules_path, out_path, interval=WATCH_INTERVAL_SEC,
+              checkpoint_path=CHECKPOINT_FILE, once=False):
+    """Headless loop: scan, write hits to `out_path`, save checkpoints, sleep."""
+    rules = compile_rules(_load_rules(rules_path))
+    if not rules:
+        raise SystemExit(f"No rules in {rules_path}")
+    checkpoints = _load_checkpoints(checkpoint_path)
+    print(f"Watching {top} with {len(rules)} rule(s), hits -> {out_path}",
+          file=sys.stderr)
+    while True:
+        started = time.monotonic()
+        hits = 0
+        with open(out_path, "a", encoding="utf-8") as out:
+            def emit(name, row):
+                nonlocal hits
+                hits += 1
+                out.write(json.dumps({
+                    "rule": name,
+                    "detected": datetime.datetime.now(datetime.timezone.utc)
+                                .isoformat(timespec='seconds'),
+                    "row": {col: row[col] for col in COLUMNS},
+                }) + "\n")
+            sources, records = watch_once(top, rules, checkpoints, emit)
+        _save_checkpoints(checkpoint_path, checkpoints)
+        print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} {sources} file(s), "
+              f"{records:,} new record(s), {hits:,} hit(s) in "
+              f"{time.monotonic() - started:.1f}s", file=sys.stderr)
+        if once:
+            return
+        time.sleep(interval)
+
 # Main application class
 class JSONViewerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("NSG Flow Log JSON Viewer")
-        self.loaded_files = {}  # Maps full path to parsed data (list of records)
+        self.loaded_files = {}  # Maps listbox label to full path ("Open Other" files)
+        self.data_windows = set()   # open DataWindow objects
+        self._discovery_gen = 0     # bumped to stop a running file listing
+        self._longest_label = 0
+        self.rollups = None         # hourly rollup catalog, loaded on first use
+        self._rollup_lock = threading.Lock()
+        self._rollup_save_lock = threading.Lock()   # one catalog write at a time
+        self._rollups_dirty = False                 # catalog changed since last write
+        self._rollups_saved = time.monotonic()
+        self.file_cache = ParsedFileCache(CACHE_BUDGET_MB * 1024 * 1024)
         self._search_progress_q = queue.Queue()
 
         # Set modern theme
@@ -134,7 +1982,7 @@ class JSONViewerApp:
         style.theme_use('clam')  # 'clam' is a cleaner default theme
 
         # Load any previously saved filter history
-        self.filter_history = _load_history()          # {'src': [], 'dst': [], 'port': []}
+        self.filter_history = _load_history()          # {'src': [], 'dst': [], 'port': [], 'query': []}
 
         self.create_widgets()
     
@@ -168,13 +2016,14 @@ class JSONViewerApp:
     def _clear_history(self):
         """Erase the persisted history and update all comboboxes."""
         if messagebox.askyesno("Confirm", "Delete all saved filter history?"):
-            self.filter_history = {"src": [], "dst": [], "port": []}
+            self.filter_history = {"src": [], "dst": [], "port": [], "query": []}
             _save_history(self.filter_history)
 
             # refresh any open comboboxes (main window + possibly opened data windows)
             for cb, key in [(self.src_cb, "src"),
                             (self.dst_cb, "dst"),
-                            (self.port_cb, "port")]:
+                            (self.port_cb, "port"),
+                            (self.query_cb, "query")]:
                 cb['values'] = []          # clear dropdown
                 cb.set("")                 # clear current text
 
@@ -212,7 +2061,8 @@ class JSONViewerApp:
         file_frame = ttk.Frame(search_outer)
         file_frame.pack(fill='both', expand=True, padx=5)
 
-        self.file_listbox = tk.Listbox(file_frame, height=10, width=60)
+        self.file_listbox = tk.Listbox(file_frame, height=10, width=60,
+                                       selectmode=tk.EXTENDED)
         file_scrollbar = ttk.Scrollbar(file_frame,
                                       orient='vertical',
                                       command=self.file_listbox.yview)
@@ -253,7 +2103,14 @@ class JSONViewerApp:
             search_section, "port", 10)
         self.port_cb.grid(row=0, column=5, sticky='w', padx=2, pady=2)
 
-
+        # Query expression over all columns, e.g. flowState=D and bytesSrcToDest>1e6
+        ttk.Label(search_section, text="Query:").grid(row=1, column=0,
+                                                    sticky='e', padx=2, pady=2)
+        self.query_cb, self.query_var = self._make_history_combobox(
+            search_section, "query", 60)
+        self.query_cb.grid(row=1, column=1, columnspan=5, sticky='we',
+                           padx=2, pady=2)
+        self.query_cb.bind('<Return>', lambda e: self.search_in_files())
 
         # Search button
         self.search_files_btn = ttk.Button(
@@ -300,18 +2157,72 @@ class JSONViewerApp:
                                    command=self.open_files)
         self.open_btn.pack(side='left', padx=5)
 
+        self.sessions_btn = ttk.Button(control_frame,
+                                       text="Sessions",
+                                       command=self.show_sessions_for_selected)
+        self.sessions_btn.pack(side='left', padx=5)
+
+        self.rollup_btn = ttk.Button(control_frame,
+                                     text="Build Rollups",
+                                     command=self.build_rollups)
+        self.rollup_btn.pack(side='left', padx=5)
+
+        self.overview_btn = ttk.Button(control_frame,
+                                       text="Overview",
+                                       command=self.show_overview)
+        self.overview_btn.pack(side='left', padx=5)
+
+        self.compare_btn = ttk.Button(control_frame,
+                                      text="Compare",
+                                      command=self.show_compare_dialog)
+        self.compare_btn.pack(side='left', padx=5)
+
+        self.rules_btn = ttk.Button(control_frame,
+                                    text="Rules",
+                                    command=self.show_rules_window)
+        self.rules_btn.pack(side='left', padx=5)
+
+        # Parsed-file cache counters and memory readout (refreshed periodically)
+        self.cache_label = ttk.Label(control_frame, text="")
+        self.cache_label.pack(side='right', padx=5)
+        self.memory_label = ttk.Label(control_frame, text="")
+        self.memory_label.pack(side='right', padx=5)
+
         # -----------------------------------------------------------------
-        # Load files, auto‑size window, status bar
+        # Status bar, then list files in the background (the window is
+        # shown at once and the list fills in, auto-sizing as it grows)
         # -----------------------------------------------------------------
-        self.load_existing_json_files()
-        self.auto_size_window()
-
         self.status_bar = ttk.Label(self.root,
                                     text="Ready",
                                     relief=tk.SUNKEN,
                                     anchor='w')
         self.status_bar.pack(side='bottom', fill='x')
 
+        self.load_existing_json_files()
+        self._poll_cache_stats()
+
+    def _poll_cache_stats(self):
+        """Refresh the cache and memory readouts once a second."""
+        self.cache_label.config(text=self.file_cache.summary())
+        self.memory_label.config(text=self.memory_summary())
+        if self._rollups_dirty and \
+                time.monotonic() - self._rollups_saved >= ROLLUP_SAVE_SEC:
+            self._rollups_saved = time.monotonic()
+            threading.Thread(target=self.flush_rollups, daemon=True).start()
+        self.root.after(1000, self._poll_cache_stats)
+
+    def memory_summary(self):
+        """Rows and approximate bytes held by open windows, plus process RSS."""
+        windows = list(self.data_windows)
+        rows = sum(len(w.rows) for w in windows)
+        held = sum(w.approx_bytes() for w in windows)
+        rss = process_rss_bytes()
+        text = (f"Windows: {len(windows)} | rows held: {rows:,} "
+                f"(~{format_mb(held)})")
+        if rss is not None:
+            text += f" | RSS {format_mb(rss)}"
+        return text
+
     def on_file_double_click(self, event):
         """Handle double-click on a file in the listbox"""
         selection = self.file_listbox.curselection()
@@ -320,50 +2231,84 @@ class JSONViewerApp:
             self.open_selected_files()
 
     def load_existing_json_files(self):
-        """Load all JSON files in the current directory and subdirectories"""
+        """List all flow logs (.json, .json.gz, zip members) in the current
+        directory and subdirectories.  The walk runs on a worker thread and
+        the names are added to the listbox in batches."""
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
         # Clear existing loaded files (this prevents duplicate entries)
         self.loaded_files.clear()
+        self._longest_label = 0
+
+        self._discovery_gen += 1
+        gen = self._discovery_gen
+        batches = queue.Queue()
+
+        def walk():
+            batch, flushed = [], time.monotonic()
+            for _, relative_path in iter_flow_log_files(current_dir):
+                if gen != self._discovery_gen:
+                    return                      # superseded – stop walking
+                batch.append(relative_path)
+                now = time.monotonic()
+                if len(batch) >= DISCOVERY_BATCH or now - flushed > DISCOVERY_FLUSH_SEC:
+                    batches.put(batch)
+                    batch, flushed = [], now
+            batches.put(batch)
+            batches.put(None)
+
+        threading.Thread(target=walk, daemon=True).start()
+        self.status_bar.config(text="Listing files …")
+        self._poll_discovery(gen, batches)
+
+    def _poll_discovery(self, gen, batches):
+        """Move listed names into the listbox; stops when superseded."""
+        if gen != self._discovery_gen:
+            return
+        try:
+            while True:
+                batch = batches.get_nowait()
+                if batch is None:
+                    self.status_bar.config(
+                        text=f"{self.file_listbox.size():,} file(s) listed")
+                    return
+                if batch:
+                    self.file_listbox.insert(tk.END, *batch)
+                    self._longest_label = max(self._longest_label,
+                                              max(map(len, batch)))
+                    self.auto_size_window()
+        except queue.Empty:
+            pass
+        self.status_bar.config(
+            text=f"Listing files … {self.file_listbox.size():,} found")
+        self.root.after(50, self._poll_discovery, gen, batches)
 
-        for root, dirs, files in os.walk(current_dir):
-            for filename in files:
-                if filename.lower().endswith('.json'):
-                    # Insert full path to show file location
-                    full_path = os.path.join(root, filename)
-                    relative_path = os.path.relpath(full_path, current_dir)
-                    self.file_listbox.insert(tk.END, relative_path)
+    def _stop_discovery(self):
+        """Stop adding listed files, e.g. before the listbox shows results."""
+        self._discovery_gen += 1
 
     def auto_size_window(self):
-        """Auto-size window based on the longest filename in the list"""
-        if not self.file_listbox.size():
+        """Auto-size window based on the longest filename listed so far"""
+        if not self._longest_label:
             return
 
-        # Get all filenames and find the longest one
-        longest_filename = ""
-        for i in range(self.file_listbox.size()):
-            filename = self.file_listbox.get(i)
-            if len(filename) > len(longest_filename):
-                longest_filename = filename
-
-        # Calculate window width based on longest filename with reasonable padding
-        if longest_filename:
-            # Reduced character-to-pixel ratio and less padding
-            window_width = max(300, len(longest_filename) * 8 + 100)
+        # Reduced character-to-pixel ratio and less padding
+        window_width = max(300, self._longest_label * 8 + 100)
 
-            # Set the minimum size to ensure we can see the full content
-            self.root.minsize(window_width, 300)
+        # Set the minimum size to ensure we can see the full content
+        self.root.minsize(window_width, 300)
 
 
 
-    def _autosize_tree_columns(self, tree, columns, data):
+    def _autosize_tree_columns(self, tree, columns, stats):
         """
         Resize each Treeview column so that it is wide enough for:
           • the column heading text
-          • the longest cell value in that column (across all rows)
+          • the longest cell value in that column (from the precomputed
+            ColumnStats – no row scan)
         The width is expressed in pixels; a small buffer is added to avoid clipping.
         """
-        if not data or not columns:
+        if not stats or not stats.rows or not columns:
             return
 
         # Helper: get pixel width of a string using the default treeview font
@@ -377,15 +2322,9 @@ class JSONViewerApp:
         max_width  = 500        # optional hard cap to keep the UI sane
 
         for col in columns:
-            # Start with header width
-            best = text_width(col)
-
-            # Scan every row for the longest value in this column
-            for row in data:
-                cell = str(row.get(col, ""))
-                w = text_width(cell)
-                if w > best:
-                    best = w
+            # Header width or longest value, whichever is wider
+            best = max(text_width(col),
+                       int(stats.max_len.get(col, 0) * 7.5))
 
             # Apply buffer and limits
             final_w = max(min_width, min(best + buffer_px, max_width))
@@ -393,73 +2332,31 @@ class JSONViewerApp:
 
     # Function to map flow tuple fields to their proper names and values
     def map_flow_tuple(self, fields):
-        if len(fields) != 13:
-            return {}
-
-        row = {}
-        for i, key in enumerate(tuple_fields):  # Use the new tuple_fields list
-            value = fields[i]
-
-            if key == "proto":
-                row[key] = f"{value} ({proto_map.get(value, value)})" if value in proto_map else value
-            elif key == "trafficFlow": 
-                row[key] = f"{value} ({traffic_flow_map.get(value, value)})" if value in traffic_flow_map else value
-            elif key == "flowState": 
-                row[key] = f"{value} ({flow_state_map.get(value, value)})" if value in flow_state_map else value
-            elif key == "encryption":
-                row[key] = f"{value} ({encryption_map.get(value, value)})" if value in encryption_map else value
-            elif key == "Timestamp":  # handle the new column name here
-                try:
-                    timestamp = int(value)
-                    dt = datetime.datetime.fromtimestamp(timestamp / 1000)  # assume milliseconds
-                    row[key] = dt.strftime('%Y-%m-%d %H:%M:%S')
-                except (ValueError, OverflowError):
-                    row[key] = value  # fallback to original string on error
-            else:
-                row[key] = value
-
-        return row
-
-    # Process flow records from loaded files
-    def process_flow_records(self):
-        processed_data = []
-        for record in self.loaded_files.values():
-            vnet = extract_vnet(record)
-            for r in record:
-                if 'flowRecords' in r and 'flows' in r['flowRecords']:
-                    for flow in r['flowRecords']['flows']:
-                        acl_id = flow.get('aclID', '')
-                        nsg = extract_nsg(acl_id)
-                        for group in flow['flowGroups']:
-                            rule_name = group.get('rule', '')
-                            for tuple_str in group.get('flowTuples', []):
-                                fields = tuple_str.split(',')
-                                row = self.map_flow_tuple(fields)
-                                if row:
-                                    # Add vnet, nsg, and rule
-                                    row['vnet'] = vnet
-                                    row['nsg'] = nsg
-                                    row['rule'] = rule_name
-                                    processed_data.append(row)
-        return processed_data
+        return map_flow_tuple(fields)
 
     def open_files(self):
         file_paths = filedialog.askopenfilenames(
             title="Select JSON Files",
-            filetypes=[("JSON Files", "*.json")]
+            filetypes=[("Flow logs", "*.json *.json.gz *.zip"),
+                       ("JSON Files", "*.json"),
+                       ("Compressed", "*.json.gz *.zip")]
         )
         if not file_paths:
             return
 
         for path in file_paths:
             try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                records = data.get("records", [])
-                self.loaded_files[path] = records
-                filename = os.path.basename(path)
-                self.file_listbox.insert(tk.END, filename)
+                sources = expand_source(path)
+                for source in sources:
+                    self.loaded_files[source] = source
+                    self.file_listbox.insert(tk.END, source)
+                if path.lower().endswith('.zip'):
+                    # archives can hold many files – list them, open on demand
+                    self.status_bar.config(
+                        text=f"{len(sources)} file(s) listed from {os.path.basename(path)}")
+                    continue
+                self.display_data_window([], os.path.basename(path),
+                                         loader=self._start_load(path))
 
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to process {path}: {str(e)}")
@@ -477,41 +2374,20 @@ class JSONViewerApp:
             return
 
         rel_path = self.file_listbox.get(sel[0])          # e.g. "subdir/file.json"
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        full_path = os.path.join(current_dir, rel_path)
+        full_path = self._full_path(rel_path)
 
         try:
-            # Load the JSON and turn it into rows for the table
-            with open(full_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            records = data.get("records", [])
-            processed = self._process_records_for_display(records, full_path)
-
-            # Show the data window
-            self.display_data_window(processed, os.path.basename(rel_path))
+            # Show the data window at once; rows arrive from a background
+            # load (or straight from the parsed-file cache)
+            data_win = self.display_data_window(
+                [], os.path.basename(rel_path),
+                loader=self._start_load(full_path))
 
             # Inject the main‑window filter values into the new window
-            data_win = self.root.winfo_children()[-1]   # newest Toplevel
-
-            for child in data_win.winfo_children():
-                if isinstance(child, ttk.Frame):          # table_frame
-                    for sub in child.winfo_children():
-                        if (isinstance(sub, ttk.LabelFrame) and
-                                sub.cget('text') == "Filter rows"):
-                            combos = [w for w in sub.winfo_children()
-                                      if isinstance(w, ttk.Combobox)]
-                            if len(combos) >= 3:
-                                combos[0].set(self.src_var.get())
-                                combos[1].set(self.dst_var.get())
-                                combos[2].set(self.port_var.get())
-
-                                # click “Apply Filter”
-                                for w in sub.winfo_children():
-                                    if (isinstance(w, ttk.Button) and
-                                            w.cget('text') == "Apply Filter"):
-                                        w.invoke()
-                                        break
-                            break
+            if any(v.get().strip() for v in (self.src_var, self.dst_var,
+                                             self.port_var, self.query_var)):
+                data_win.set_filters(self.src_var.get(), self.dst_var.get(),
+                                     self.port_var.get(), self.query_var.get())
         except Exception as e:
             messagebox.showerror("Error", f"Failed to open {rel_path}:\n{e}")
 
@@ -519,26 +2395,654 @@ class JSONViewerApp:
 
 
 
-    def _process_records_for_display(self, records, full_path):
-        """Convert raw `records` into the list of rows shown in the data window."""
-        processed_data = []
-        for r in records:
-            if 'flowRecords' not in r or 'flows' not in r['flowRecords']:
-                continue
-            vnet_name = extract_vnet(r)
-            for flow in r['flowRecords']['flows']:
-                nsg_name = extract_nsg(flow.get('aclID', ''))
-                for group in flow.get('flowGroups', []):
-                    rule_name = group.get('rule', '')
-                    for tup in group.get('flowTuples', []):
-                        fields = tup.split(',')
-                        row = self.map_flow_tuple(fields)
-                        if row:
-                            row['vnet'] = vnet_name
-                            row['nsg']  = nsg_name
-                            row['rule'] = rule_name
-                            processed_data.append(row)
-        return processed_data
+    def _start_load(self, full_path):
+        """Start a BackgroundLoader for `full_path`, served from the cache if possible."""
+        def on_complete(rows, stats):
+            self.file_cache.put(full_path, rows, stats)
+            # the rollup has its own thread so DONE is not held up by it
+            threading.Thread(target=self._record_rollup, args=(full_path, rows),
+                             daemon=True).start()
+
+        loader = BackgroundLoader(
+            full_path, self._process_records_for_display,
+            on_complete=on_complete,
+            preloaded=self.file_cache.peek(full_path),
+            preview=True)
+        return loader.start()
+
+    def _run_in_background(self, work, on_done, on_progress=None):
+        """
+        Run `work()` on a worker thread and hand its result to `on_done`
+        on the Tk thread.  Exceptions are reported in a message box.
+        With `on_progress`, `work(report)` may call `report(text)` and each
+        text is passed to `on_progress` on the Tk thread.
+        """
+        result_q = queue.Queue(maxsize=1)
+        progress_q = queue.Queue()
+
+        def runner():
+            try:
+                if on_progress is not None:
+                    result_q.put((True, work(progress_q.put)))
+                else:
+                    result_q.put((True, work()))
+            except Exception as e:
+                result_q.put((False, e))
+
+        threading.Thread(target=runner, daemon=True).start()
+
+        def poll():
+            text = None
+            while not progress_q.empty():
+                text = progress_q.get_nowait()
+            if text is not None:
+                on_progress(text)
+            try:
+                ok, value = result_q.get_nowait()
+            except queue.Empty:
+                self.root.after(100, poll)
+                return
+            if ok:
+                on_done(value)
+            else:
+                messagebox.showerror("Error", str(value))
+
+        poll()
+
+    # -------------------------------------------------
+    #   Hourly rollups and the overview window
+    # -------------------------------------------------
+    def _rollup_catalog(self):
+        with self._rollup_lock:
+            if self.rollups is None:
+                self.rollups = _load_rollups()
+            return self.rollups
+
+    def _rollup_snapshot(self):
+        """A copy of the catalog that other threads can no longer change."""
+        catalog = self._rollup_catalog()
+        with self._rollup_lock:
+            return {**catalog, "files": dict(catalog["files"])}
+
+    def _record_rollup(self, source, rows):
+        """
+        Store the hourly rollup of a freshly parsed file (any thread).  The
+        catalog is only marked dirty here; _poll_cache_stats writes it at
+        most every ROLLUP_SAVE_SEC and main() writes it once more on exit.
+        """
+        try:
+            sig = list(source_signature(source))
+        except OSError:
+            return
+        hours = compute_rollups(rows)
+        catalog = self._rollup_catalog()
+        with self._rollup_lock:
+            catalog["files"][source] = {"sig": sig, "hours": hours}
+            self._rollups_dirty = True
+
+    def flush_rollups(self):
+        """Write the rollup catalog to ROLLUP_FILE if it changed (any thread)."""
+        with self._rollup_save_lock:
+            with self._rollup_lock:
+                if not self._rollups_dirty:
+                    return
+                snapshot = {**self.rollups, "files": dict(self.rollups["files"])}
+                self._rollups_dirty = False
+            try:
+                _save_rollups(snapshot)
+            except OSError:
+                with self._rollup_lock:
+                    self._rollups_dirty = True      # try again next time
+
+    def build_rollups(self):
+        """Ingest every listed file whose rollup is missing or out of date."""
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+
+        def work(report):
+            catalog = self._rollup_catalog()
+            sources = [src for src, _ in iter_flow_log_files(current_dir)]
+            built = 0
+            for i, source in enumerate(sources, 1):
+                try:
+                    sig = list(source_signature(source))
+                except OSError:
+                    continue
+                entry = catalog["files"].get(source)
+                if entry is not None and entry.get("sig") == sig:
+                    continue
+                report(f"Building rollups {i}/{len(sources)}: "
+                       f"{os.path.relpath(source, current_dir)}")
+                try:
+                    rows, _ = self._parse_file(source)
+                except Exception:
+                    continue            # unreadable files are skipped
+                self._record_rollup(source, rows)
+                built += 1
+
+            with self._rollup_lock:
+                # forget files that have been deleted
+                for source in list(catalog["files"]):
+                    if not os.path.exists(split_source(source)[0]):
+                        del catalog["files"][source]
+                        self._rollups_dirty = True
+            self.flush_rollups()
+            return built, len(sources)
+
+        def done(result):
+            built, total = result
+            self.status_bar.config(
+                text=f"Rollups up to date: {built} file(s) ingested, {total} listed")
+
+        self.status_bar.config(text="Building rollups …")
+        self._run_in_background(work, done,
+                                lambda text: self.status_bar.config(text=text))
+
+    def show_overview(self):
+        """Totals and deny rates per hour/day and per NSG rule, from the rollups only."""
+        catalog = self._rollup_snapshot()
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+
+        win = tk.Toplevel(self.root)
+        win.title("Overview")
+        win.geometry("1000x650")
+
+        controls = ttk.Frame(win, padding=5)
+        controls.pack(fill='x')
+        ttk.Label(controls, text="NSG:").pack(side='left')
+        nsgs = sorted({g[1] for e in catalog["files"].values()
+                       for groups in e.get("hours", {}).values() for g in groups})
+        nsg_var = tk.StringVar(value="All")
+        nsg_cb = ttk.Combobox(controls, textvariable=nsg_var, state='readonly',
+                              values=["All"] + nsgs, width=30)
+        nsg_cb.pack(side='left', padx=5)
+        ttk.Label(controls, text="Bin:").pack(side='left', padx=(15, 0))
+        bin_var = tk.StringVar(value="Hour")
+        bin_cb = ttk.Combobox(controls, textvariable=bin_var, state='readonly',
+                              values=["Hour", "Day"], width=8)
+        bin_cb.pack(side='left', padx=5)
+        summary = ttk.Label(controls, text="")
+        summary.pack(side='left', padx=15)
+
+        canvas = tk.Canvas(win, height=240, background="white")
+        canvas.pack(fill='x', padx=5, pady=5)
+        ttk.Label(win, text="Bars: flow tuples (red = denied), line: deny rate. "
+                            "Click a bar to list its files in the main window.").pack(anchor='w', padx=5)
+
+        table_frame = ttk.Frame(win)
+        table_frame.pack(fill='both', expand=True, padx=5, pady=5)
+        group_cols = ["nsg", "rule", "tuples", "denies", "denyRate%", "bytes", "packets"]
+        tree = ttk.Treeview(table_frame, columns=group_cols, show='headings')
+        for col in group_cols:
+            tree.heading(col, text=col)
+            tree.column(col, width=120, anchor="center")
+        scrollbar_y = tk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
+        tree.config(yscrollcommand=scrollbar_y.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar_y.pack(side='right', fill='y')
+
+        state = {"bins": {}, "start": 0, "step": 3600, "bar_w": 1.0, "pad": 40}
+
+        def redraw(event=None):
+            nsg = nsg_var.get()
+            per_hour, per_group = overview_totals(self._rollup_snapshot(),
+                                                  None if nsg == "All" else nsg)
+            step = 86400 if bin_var.get() == "Day" else 3600
+
+            bins = {}
+            for hour, (tuples, denies, nbytes, packets, sources) in per_hour.items():
+                b = bins.setdefault(hour // step * step, [0, 0, 0, 0, set()])
+                b[0] += tuples
+                b[1] += denies
+                b[2] += nbytes
+                b[3] += packets
+                b[4].update(sources)
+
+            canvas.delete('all')
+            tree.delete(*tree.get_children())
+            state["bins"], state["step"] = bins, step
+            if not bins:
+                summary.config(text="")
+                canvas.create_text(20, 20, anchor='nw',
+                                   text="No rollups yet – use “Build Rollups” in the main window.")
+                return
+
+            total = sum(b[0] for b in bins.values())
+            denied = sum(b[1] for b in bins.values())
+            summary.config(text=f"{total:,} tuples, {denied:,} denied "
+                                f"({denied * 100 / total:.1f}%), "
+                                f"{sum(b[2] for b in bins.values()) / 1048576:,.1f} MB")
+
+            start, end = min(bins), max(bins)
+            n = (end - start) // step + 1
+            width = max(canvas.winfo_width(), 600)
+            height = int(canvas.cget('height'))
+            pad = state["pad"]
+            bar_w = (width - 2 * pad) / n
+            state["start"], state["bar_w"] = start, bar_w
+            peak = max(b[0] for b in bins.values()) or 1
+            plot_h = height - 2 * pad
+
+            rate_points = []
+            for key in sorted(bins):
+                tuples, denies = bins[key][0], bins[key][1]
+                x0 = pad + (key - start) // step * bar_w
+                x1 = x0 + max(1.0, bar_w - 1)
+                y_total = height - pad - tuples / peak * plot_h
+                y_deny = height - pad - denies / peak * plot_h
+                canvas.create_rectangle(x0, y_total, x1, height - pad,
+                                        fill="#7aa6d6", outline="")
+                if denies:
+                    canvas.create_rectangle(x0, y_deny, x1, height - pad,
+                                            fill="#e06666", outline="")
+                if tuples:
+                    rate_points += [(x0 + x1) / 2,
+                                    height - pad - denies / tuples * plot_h]
+            if len(rate_points) >= 4:
+                canvas.create_line(*rate_points, fill="#800000", width=1)
+
+            fmt = '%Y-%m-%d' if step == 86400 else '%Y-%m-%d %H:00'
+            canvas.create_text(pad, height - pad + 5, anchor='nw',
+                               text=datetime.datetime.fromtimestamp(start).strftime(fmt))
+            canvas.create_text(width - pad, height - pad + 5, anchor='ne',
+                               text=datetime.datetime.fromtimestamp(end).strftime(fmt))
+            canvas.create_text(pad - 5, pad, anchor='ne', text=f"{peak:,}")
+            canvas.create_text(width - pad + 5, pad, anchor='nw', text="100%",
+                               fill="#800000")
+
+            for (g_nsg, rule), (tuples, denies, nbytes, packets) in sorted(
+                    per_group.items(), key=lambda kv: -kv[1][0]):
+                item_id = tree.insert("", "end", values=[
+                    g_nsg, rule, f"{tuples:,}", f"{denies:,}",
+                    f"{denies * 100 / tuples:.1f}" if tuples else "0.0",
+                    f"{nbytes:,}", f"{packets:,}"])
+                if denies:
+                    tree.item(item_id, tags="deny")
+            tree.tag_configure("deny", background="#ffcccc")
+
+        def drill_down(event):
+            """List the files behind the clicked bar in the main window."""
+            bar_w = state["bar_w"]
+            if not state["bins"] or bar_w <= 0:
+                return
+            slot = int((event.x - state["pad"]) // bar_w)
+            key = state["start"] + slot * state["step"]
+            entry = state["bins"].get(key)
+            if entry is None:
+                return
+            sources = sorted(entry[4])
+            self._stop_discovery()
+            self.file_listbox.delete(0, tk.END)
+            for source in sources:
+                label = os.path.relpath(source, current_dir)
+                if label.startswith(os.pardir):
+                    label = source
+                self.loaded_files[label] = source
+                self.file_listbox.insert(tk.END, label)
+            self.status_bar.config(
+                text=f"{len(sources)} file(s) for "
+                     f"{datetime.datetime.fromtimestamp(key):%Y-%m-%d %H:00} "
+                     f"({entry[0]:,} tuples, {entry[1]:,} denied)")
+
+        nsg_cb.bind('<<ComboboxSelected>>', redraw)
+        bin_cb.bind('<<ComboboxSelected>>', redraw)
+        canvas.bind('<Configure>', redraw)
+        canvas.bind('<Button-1>', drill_down)
+        redraw()
+        return win
+
+    # -------------------------------------------------
+    #   Sessions (B/C/E stitched flows)
+    # -------------------------------------------------
+    def show_sessions_for_selected(self):
+        """Stitch the flows of every selected file into one sessions view."""
+        labels = [self.file_listbox.get(i) for i in self.file_listbox.curselection()]
+        if not labels:
+            return
+        paths = [self._full_path(label) for label in labels]
+
+        def work():
+            sources = [self._time_ordered_source(p) for p in paths]
+            return list(stitch_sessions(iter_rows_by_time(sources)))
+
+        def done(sessions):
+            self.status_bar.config(
+                text=f"{len(sessions)} session(s) from {len(paths)} file(s)")
+            title = labels[0] if len(labels) == 1 else f"{len(labels)} files"
+            self.display_table_window(f"Sessions - {title}",
+                                      SESSION_COLUMNS, sessions)
+
+        self.status_bar.config(text=f"Stitching sessions for {len(paths)} file(s) …")
+        self._run_in_background(work, done)
+
+    def _time_ordered_source(self, path):
+        """
+        `(first_ts, load)` of one file for iter_rows_by_time.  Open files are
+        served from the cache; the others are parsed when the merge reaches
+        them and not added to it.  Their start is taken from a current
+        rollup if there is one, else from a scan of the raw bytes.
+        """
+        cached = self.file_cache.peek(path)
+        if cached is not None:
+            rows = cached[0]
+            return min(map(_row_ts, rows), default=-1), lambda: rows
+
+        first_ts = None
+        catalog = self._rollup_catalog()
+        with self._rollup_lock:
+            entry = catalog["files"].get(path)
+        try:
+            if entry and entry["hours"] and entry["sig"] == list(source_signature(path)):
+                first_ts = min(map(int, entry["hours"])) * 1000
+        except OSError:
+            pass
+        if first_ts is None:
+            first_ts = first_tuple_timestamp(read_flow_log_bytes(path))
+        return first_ts, lambda: self._parse_file(path)[0]
+
+    def show_sessions_for_rows(self, rows, title):
+        """Sessions view for rows already loaded in a data window."""
+        self._run_in_background(
+            lambda: list(stitch_sessions(iter_rows_by_time([(-1, lambda: rows)]))),
+            lambda sessions: self.display_table_window(
+                f"Sessions - {title}", SESSION_COLUMNS, sessions))
+
+    # -------------------------------------------------
+    #   Saved rules (named queries, also used by --watch)
+    # -------------------------------------------------
+    def show_rules_window(self):
+        """List, add, delete and run the saved rules in RULES_FILE."""
+        win = tk.Toplevel(self.root)
+        win.title("Rules")
+        win.geometry("800x400")
+
+        frame = ttk.Frame(win)
+        frame.pack(fill='both', expand=True, padx=5, pady=5)
+        tree = ttk.Treeview(frame, columns=("name", "query"), show='headings')
+        tree.heading("name", text="name")
+        tree.heading("query", text="query")
+        tree.column("name", width=180)
+        tree.column("query", width=580)
+        scrollbar_y = tk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.config(yscrollcommand=scrollbar_y.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar_y.pack(side='right', fill='y')
+
+        edit = ttk.Frame(win)
+        edit.pack(fill='x', padx=5)
+        name_var, query_var = tk.StringVar(), tk.StringVar()
+        ttk.Label(edit, text="Name:").grid(row=0, column=0, sticky='e')
+        ttk.Entry(edit, textvariable=name_var, width=25).grid(row=0, column=1, sticky='w')
+        ttk.Label(edit, text="Query:").grid(row=0, column=2, sticky='e', padx=(10, 0))
+        ttk.Entry(edit, textvariable=query_var, width=60).grid(row=0, column=3, sticky='we')
+        edit.grid_columnconfigure(3, weight=1)
+        msg = ttk.Label(edit, text="", foreground="#a00000")
+        msg.grid(row=1, column=0, columnspan=4, sticky='w')
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            for name, text in sorted(_load_rules().items()):
+                tree.insert("", "end", iid=name, values=(name, text))
+
+        def on_select(event=None):
+            sel = tree.selection()
+            if sel:
+                name_var.set(sel[0])
+                query_var.set(tree.set(sel[0], "query"))
+
+        def save():
+            name, text = name_var.get().strip(), query_var.get().strip()
+            if not name or not text:
+                msg.config(text="A rule needs a name and a query")
+                return
+            try:
+                compile_query(text)
+            except QueryError as e:
+                msg.config(text=str(e))
+                return
+            msg.config(text="")
+            rules = _load_rules()
+            rules[name] = text
+            _save_rules(rules)
+            refresh()
+
+        def delete():
+            rules = _load_rules()
+            for name in tree.selection():
+                rules.pop(name, None)
+            _save_rules(rules)
+            refresh()
+
+        def search():
+            """Search the files in the main window with the selected rule."""
+            sel = tree.selection()
+            if sel:
+                self.query_cb.set(tree.set(sel[0], "query"))
+                self.search_in_files()
+
+        tree.bind('<<TreeviewSelect>>', on_select)
+        buttons = ttk.Frame(win)
+        buttons.pack(pady=5)
+        ttk.Button(buttons, text="Save Rule", command=save).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Delete", command=delete).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Search Files", command=search).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Close", command=win.destroy).pack(side='left', padx=5)
+        ttk.Label(win, text=f"Saved in {RULES_FILE}; run headless with "
+                            f"--watch DIR to append hits to a JSON Lines file.").pack(anchor='w', padx=5)
+        refresh()
+        return win
+
+    # -------------------------------------------------
+    #   Compare two file selections / time ranges
+    # -------------------------------------------------
+    def show_compare_dialog(self):
+        """
+        Pick side A (baseline) and side B (now), each a set of files and an
+        optional time range, and list the flows that are new, gone or
+        changed in volume.  Side B uses side A's files when it has none.
+        """
+        win = tk.Toplevel(self.root)
+        win.title("Compare")
+        win.resizable(False, False)
+        sides = {}
+
+        for col, (name, text) in enumerate((("A", "A – baseline"), ("B", "B – now"))):
+            frame = ttk.LabelFrame(win, text=text, padding=5)
+            frame.grid(row=0, column=col, sticky='nsew', padx=5, pady=5)
+            side = {"sources": [], "from": tk.StringVar(), "to": tk.StringVar()}
+            files_label = ttk.Label(frame, text="no files", width=30)
+            files_label.grid(row=0, column=0, columnspan=2, sticky='w')
+
+            def use_selected(side=side, files_label=files_label):
+                labels = [self.file_listbox.get(i)
+                          for i in self.file_listbox.curselection()]
+                side["sources"] = [self._full_path(label) for label in labels]
+                files_label.config(text=f"{len(labels)} file(s)" if labels
+                                   else "no files")
+
+            ttk.Button(frame, text="Use Selected Files",
+                       command=use_selected).grid(row=1, column=0, columnspan=2,
+                                                  sticky='w', pady=2)
+            ttk.Label(frame, text="From:").grid(row=2, column=0, sticky='e')
+            ttk.Entry(frame, textvariable=side["from"], width=20).grid(
+                row=2, column=1, sticky='w', pady=2)
+            ttk.Label(frame, text="To:").grid(row=3, column=0, sticky='e')
+            ttk.Entry(frame, textvariable=side["to"], width=20).grid(
+                row=3, column=1, sticky='w', pady=2)
+            sides[name] = side
+
+        ttk.Label(win, text="Times: YYYY-MM-DD [HH[:MM[:SS]]] or epoch; "
+                            "empty = unbounded").grid(row=1, column=0, columnspan=2,
+                                                      sticky='w', padx=5)
+
+        def run():
+            specs = []
+            for name in ("A", "B"):
+                side = sides[name]
+                try:
+                    lo = side["from"].get().strip()
+                    hi = side["to"].get().strip()
+                    lo = _parse_time(lo) if lo else float("-inf")
+                    hi = _parse_time(hi) if hi else float("inf")
+                except QueryError as e:
+                    messagebox.showerror("Compare", f"Side {name}: {e}", parent=win)
+                    return
+                sources = side["sources"] or (specs[0][1] if specs else [])
+                if not sources:
+                    messagebox.showerror("Compare", "Select the files for side A first.",
+                                         parent=win)
+                    return
+                if lo == float("-inf") and hi == float("inf"):
+                    lo = hi = None      # whole files, no per-row time check
+                specs.append((name, sources, lo, hi))
+            win.destroy()
+            self._run_compare(specs)
+
+        buttons = ttk.Frame(win)
+        buttons.grid(row=2, column=0, columnspan=2, pady=5)
+        ttk.Button(buttons, text="Compare", command=run).pack(side='left', padx=5)
+        ttk.Button(buttons, text="Close", command=win.destroy).pack(side='left', padx=5)
+        return win
+
+    def _run_compare(self, specs):
+        """Stream each side's files into its counter, then diff them."""
+        import tempfile
+
+        def work(report):
+            with tempfile.TemporaryDirectory(prefix="nsgcompare-") as spill_dir:
+                counters = []
+                for name, sources, lo, hi in specs:
+                    counter = FlowKeyCounter(name, spill_dir)
+                    for i, source in enumerate(sources, 1):
+                        report(f"Compare: reading side {name}, file {i}/{len(sources)}")
+                        cached = self.file_cache.peek(source)
+                        if cached is not None:
+                            count_flow_keys(cached[0], counter, lo, hi)
+                        else:
+                            text = read_flow_log_bytes(source).decode('utf-8-sig')
+                            count_flow_key_tuples(text, counter, lo, hi)
+                        del cached
+                    counters.append(counter)
+                report("Compare: diffing …")
+                return compare_flow_keys(*counters)
+
+        def done(result):
+            summary, rows = result
+            text = (f"{summary['new']:,} new, {summary['gone']:,} gone, "
+                    f"{summary['changed']:,} changed, "
+                    f"{summary['unchanged']:,} unchanged")
+            self.status_bar.config(text=f"Compare: {text}")
+            self.display_table_window(f"Compare A → B - {text}",
+                                      COMPARE_COLUMNS, rows)
+
+        self.status_bar.config(text="Compare: starting …")
+        self._run_in_background(work, done,
+                                lambda text: self.status_bar.config(text=text))
+
+    def display_table_window(self, title, columns, rows):
+        """
+        Plain sortable table for derived results (sessions, comparisons …).
+        `rows` are dicts keyed by `columns`; values sort by their own type.
+        """
+        win = tk.Toplevel(self.root)
+        win.title(title)
+        win.geometry(f"{min(max(800, len(columns) * 110), 2000)}x500")
+
+        frame = ttk.Frame(win)
+        frame.pack(fill="both", expand=True)
+
+        tree = ttk.Treeview(frame, columns=columns, show='headings')
+        scrollbar_y = tk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        scrollbar_x = tk.Scrollbar(frame, orient="horizontal", command=tree.xview)
+        tree.config(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
+        tree.grid(row=0, column=0, sticky="nsew")
+        scrollbar_y.grid(row=0, column=1, sticky="ns")
+        scrollbar_x.grid(row=1, column=0, sticky="ew")
+        frame.grid_rowconfigure(0, weight=1)
+        frame.grid_columnconfigure(0, weight=1)
+        tree.tag_configure("deny", background="#ffcccc")
+        tree.tag_configure("new", background="#d9ead3")
+
+        rows = list(rows)
+        shown = list(rows)
+        sort_state = {"col": None, "reverse": False}
+        sort_perms = {}     # column -> ascending permutation of `rows`
+
+        def fill():
+            tree.delete(*tree.get_children())
+            for row in shown:
+                item_id = tree.insert("", "end",
+                                      values=[str(row.get(c, "")) for c in columns])
+                if row.get("finalState") == "Deny" or row.get("flowState") == "D (Deny)":
+                    tree.item(item_id, tags="deny")
+                elif row.get("change") == "new":
+                    tree.item(item_id, tags="new")
+
+        def sort_by(col):
+            if sort_state["col"] == col:
+                sort_state["reverse"] = not sort_state["reverse"]
+            else:
+                sort_state["col"], sort_state["reverse"] = col, False
+            perm = sort_perms.get(col)
+            if perm is None:
+                keys = [table_sort_key(col, r.get(col, "")) for r in rows]
+                perm = sorted(range(len(keys)), key=keys.__getitem__)
+                sort_perms[col] = perm
+            order = reversed(perm) if sort_state["reverse"] else perm
+            shown[:] = [rows[i] for i in order]
+            fill()
+
+        for col in columns:
+            tree.heading(col, text=col, command=lambda c=col: sort_by(c))
+            tree.column(col, width=max(80, len(col) * 9), anchor="center")
+        fill()
+
+        def copy(sep):
+            text = sep.join(columns) + '\n'
+            for row in shown:
+                text += sep.join(str(row.get(c, "")) for c in columns) + '\n'
+            self.root.clipboard_clear()
+            self.root.clipboard_append(text)
+
+        button_frame = ttk.Frame(win)
+        button_frame.pack(pady=5)
+        ttk.Label(button_frame, text=f"{len(shown)} row(s)").pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Copy(CSV)",
+                   command=lambda: copy(',')).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Copy(Excel)",
+                   command=lambda: copy('\t')).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Close",
+                   command=win.destroy).pack(side='left', padx=5)
+        return win
+
+    def _full_path(self, label):
+        """Resolve a listbox entry to the file it refers to."""
+        if label in self.loaded_files:
+            return self.loaded_files[label]
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(current_dir, label)
+
+    def _parse_file(self, full_path):
+        """Read one flow log source; returns `(rows, None)` – see _parse_bytes."""
+        return self._parse_bytes(read_flow_log_bytes(full_path), full_path)
+
+    def _parse_bytes(self, raw, full_path):
+        """
+        Parse the raw JSON of one flow log file; returns `(rows, None)`.
+        No ColumnStats are gathered here: these parses serve search, sessions
+        and rollups, and a data window computes them if it opens the rows.
+        """
+        data = json.loads(raw)
+        rows = self._process_records_for_display(data.get("records", []),
+                                                 full_path)
+        return rows, None
+
+    def _process_records_for_display(self, records, full_path, stats=None,
+                                     fmt=None):
+        """
+        Convert raw `records` into the list of rows shown in the data window
+        (vNet or NSG v1/v2 flow logs, see parse_records).
+        """
+        return parse_records(records, stats, fmt)
 
 
     def refresh_files(self):
@@ -546,17 +3050,13 @@ class JSONViewerApp:
         # Clear current listbox
         self.file_listbox.delete(0, tk.END)
 
-        # Reload existing JSON files
+        # Reload existing JSON files (the status bar reports the progress)
         self.load_existing_json_files()
 
-        # Update status bar
-        self.status_bar.config(text="File list refreshed")
-
     def _restore_full_file_list(self):
         """Populate the file‑listbox with every JSON file under the current folder."""
         self.file_listbox.delete(0, tk.END)
         self.load_existing_json_files()          # re‑uses your existing loader
-        self.status_bar.config(text="Ready")
 
     def _clear_main_filters_and_restore(self):
         """Reset the Search‑in‑Files fields and show every JSON file again."""
@@ -564,11 +3064,13 @@ class JSONViewerApp:
         self.src_cb.set("")
         self.dst_cb.set("")
         self.port_cb.set("")
+        self.query_cb.set("")
 
         # also clear the associated StringVars (optional, but keeps them in sync)
         self.src_var.set("")
         self.dst_var.set("")
         self.port_var.set("")
+        self.query_var.set("")
 
         # Repopulate the listbox with all files
         self._restore_full_file_list()
@@ -581,22 +3083,33 @@ class JSONViewerApp:
         src  = self.src_var.get().strip()
         dst  = self.dst_var.get().strip()
         port = self.port_var.get().strip()
+        query_text = self.query_var.get().strip()
 
         # store history …
         self._push_to_history("src",  src)
         self._push_to_history("dst",  dst)
         self._push_to_history("port", port)
+        self._push_to_history("query", query_text)
 
-        if not any([src, dst, port]):          # nothing entered → show everything
+        if not any([src, dst, port, query_text]):   # nothing entered → show everything
             self._restore_full_file_list()
             return
 
+        # The three boxes and the query expression become one compiled predicate
+        try:
+            query = compile_query(combine_queries(
+                criteria_query({"sourceIP": src, "destIP": dst, "destPort": port}),
+                query_text))
+        except QueryError as e:
+            messagebox.showerror("Invalid query", str(e))
+            return
+
         # ------------------------------------------------------------------
         # Start the background thread
         # ------------------------------------------------------------------
         threading.Thread(
             target=self._search_worker,
-            args=(src, dst, port),
+            args=(query,),
             daemon=True               # dies automatically when app closes
         ).start()
 
@@ -606,22 +3119,22 @@ class JSONViewerApp:
         # ------------------------------------------------------------------
         self._poll_search_progress()
 
-    def _search_worker(self, src: str, dst: str, port: str):
+    def _search_worker(self, query):
         """
         Runs in a background thread, walks the directory tree,
         parses JSON files and puts progress messages into self._search_progress_q.
         When finished it puts a sentinel tuple ('DONE', matching_paths).
+
+        `query` is a CompiledQuery.  Files that are not cached are first
+        checked with `query.may_match_bytes` so files that cannot match are
+        never parsed; the others are parsed record by record up to the first
+        match and are not added to the file cache, so a folder-wide search
+        does not evict the files the user has open.
         """
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
-        # ---- collect all json files first so we can compute % ----------
-        all_json_files = []
-        for root, _, files in os.walk(current_dir):
-            for fname in files:
-                if fname.lower().endswith('.json'):
-                    full_path = os.path.join(root, fname)
-                    rel_path  = os.path.relpath(full_path, current_dir)
-                    all_json_files.append((full_path, rel_path))
+        # ---- collect all flow logs first so we can compute % ------------
+        all_json_files = list(iter_flow_log_files(current_dir))
 
         total_files = len(all_json_files)
         processed   = 0
@@ -634,22 +3147,14 @@ class JSONViewerApp:
                 ('FILE', rel_path, processed, total_files))
 
             try:
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                rows = self._process_records_for_display(
-                    data.get('records', []), full_path)
-
-                # row‑match logic (same as before)
-                def row_satisfies(row):
-                    if src and src.lower() not in str(row.get('sourceIP', '')).lower():
-                        return False
-                    if dst and dst.lower() not in str(row.get('destIP', '')).lower():
-                        return False
-                    if port and port.lower() not in str(row.get('destPort', '')).lower():
-                        return False
-                    return True
-
-                if any(row_satisfies(r) for r in rows):
+                cached = self.file_cache.peek(full_path)
+                if cached is not None:
+                    matched = any(query(r) for r in cached[0])
+                else:
+                    raw = read_flow_log_bytes(full_path)
+                    matched = query.may_match_bytes(raw) and \
+                        self._records_match(raw.decode('utf-8-sig'), query)
+                if matched:
                     matching_paths.append(rel_path)
 
             except Exception:
@@ -662,200 +3167,314 @@ class JSONViewerApp:
         self._search_progress_q.put(('DONE', matching_paths))
 
 
+    def _records_match(self, text, query):
+        """True as soon as one record of `text` yields a row matching `query`."""
+        fmt = None
+        for record, _ in iter_json_records(text):
+            if fmt is None:
+                fmt = detect_format(record)
+            if any(query(r) for r in parse_records([record], fmt=fmt)):
+                return True
+        return False
+
     def _poll_search_progress(self):
         """
         Called repeatedly from the Tk event loop.
         Pops items off self._search_progress_q and updates the UI.
-        When a ('DONE', …) message arrives it finalises the listbox.
+        When a ('DONE', …) message arrives it finalises the listbox
+        and stops polling.
         """
         try:
             while True:               # drain everything currently queued
                 msg = self._search_progress_q.get_nowait()
 
                 if msg[0] == 'FILE':
+                    # msg layout: ('FILE', rel_path, processed, total_files)
                     _, rel_path, processed, total = msg
-                    percent = int((processed / total) * 100) if total else 0
-                    # show both file name and percentage in the status bar
-                    self.status_bar.config(
-                        text=f"Scanning {rel_path} … ({percent}% )")
 
-                    # optional visual bar – only runs if you added the widget above
+                    # `processed` is the number of files that have already been *finished*.
+                    # The file we are currently looking at is therefore:
+                    current_index = processed + 1          # 1‑based count
+                    percent = int((current_index / total) * 100) if total else 0
+
+                    self.status_bar.config(
+                        text=f"Scanning {rel_path} (file {current_index} of {total}) {percent}%")
 
                 elif msg[0] == 'DONE':
                     matching_paths = msg[1]
-
-                    # clear listbox & fill with results
+                    self._stop_discovery()
                     self.file_listbox.delete(0, tk.END)
                     for p in sorted(matching_paths):
                         self.file_listbox.insert(tk.END, p)
 
-                    # final status line (reset progress bar to 100 %)
                     crit = []
                     if self.src_var.get():  crit.append(f'Source="{self.src_var.get()}"')
                     if self.dst_var.get():  crit.append(f'Destination="{self.dst_var.get()}"')
                     if self.port_var.get(): crit.append(f'Port="{self.port_var.get()}"')
+                    if self.query_var.get(): crit.append(f'Query="{self.query_var.get()}"')
                     self.status_bar.config(
                         text=f"{len(matching_paths)} file(s) matching: {', '.join(crit) or 'no criteria'}")
+                    return
 
         except queue.Empty:
             # nothing left right now – just wait for the next poll
             pass
 
-        # schedule the next poll (≈ every 100 ms)
+        # schedule the next poll (≈ every 100 ms)
         self.root.after(100, self._poll_search_progress)
 
 
-
-    def _poll_search_progress(self):
+    def display_data_window(self, data, filename, stats=None, loader=None):
         """
-        Called repeatedly from the Tk event loop.
-        Pops items off self._search_progress_q and updates the UI.
-        When a ('DONE', …) message arrives it finalises the listbox.
+        Show `data` in a new DataWindow.  When a BackgroundLoader is given
+        the window opens straight away and fills in as its batches arrive.
         """
-        try:
-            while True:               # drain everything currently queued
-                msg = self._search_progress_q.get_nowait()
-
-                if msg[0] == 'FILE':
-                    # msg layout: ('FILE', rel_path, processed, total_files)
-                    _, rel_path, processed, total = msg
+        return DataWindow(self, data, filename, stats, loader)
 
-                    # `processed` is the number of files that have already been *finished*.
-                    # The file we are currently looking at is therefore:
-                    current_index = processed + 1          # 1‑based count
-                    percent = int((current_index / total) * 100) if total else 0
 
-                    self.status_bar.config(
-                        text=f"Scanning {rel_path} (file {current_index} of {total}) {percent}%")
+# ----------------------------------------------------------------------
+# Memory telemetry
+# ----------------------------------------------------------------------
+def process_rss_bytes():
+    """Resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(
+                    handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except (AttributeError, OSError):
+            pass
+        return None
 
-                elif msg[0] == 'DONE':
-                    # … existing DONE handling …
-                    matching_paths = msg[1]
-                    self.file_listbox.delete(0, tk.END)
-                    for p in sorted(matching_paths):
-                        self.file_listbox.insert(tk.END, p)
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS, KiB elsewhere (and only the peak)
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
 
-                    crit = []
-                    if self.src_var.get():  crit.append(f'Source="{self.src_var.get()}"')
-                    if self.dst_var.get():  crit.append(f'Destination="{self.dst_var.get()}"')
-                    if self.port_var.get(): crit.append(f'Port="{self.port_var.get()}"')
-                    self.status_bar.config(
-                        text=f"{len(matching_paths)} file(s) matching: {', '.join(crit) or 'no criteria'}")
+def format_mb(nbytes):
+    return f"{nbytes / 1048576:,.0f} MB"
 
-        except queue.Empty:
-            # nothing left right now – just wait for the next poll
-            pass
+# ----------------------------------------------------------------------
+# Data window
+# ----------------------------------------------------------------------
+class DataWindow:
+    """
+    One data window and the state it owns: its rows and their statistics,
+    the filter index, cached sort permutations, the current filter result
+    and the Treeview item map.  Everything is released on <Destroy>, so a
+    closed window no longer keeps its dataset alive.
+    """
 
-        # schedule the next poll (≈ every 100 ms)
-        self.root.after(100, self._poll_search_progress)
+    # Columns for the Treeview
+    columns = COLUMNS
+
+    def __init__(self, app, data, filename, stats=None, loader=None):
+        self.app = app
+        self.root = app.root
+        self.filename = filename
+        self.loader = loader
+
+        # Column statistics are normally gathered while parsing; fall back
+        # to a single pass for callers that did not collect them.
+        self.rows = list(data)
+        self.stats = stats if stats is not None else ColumnStats.from_rows(self.rows)
+
+        self.index = None                      # RowIndex, built in the background
+        self.sort_col = None
+        self.sort_reverse = False
+        self.sort_perms = {}                   # column -> ascending index list
+        self.shown_idx = list(range(len(self.rows)))   # current filter result
+        self.shown_rows = []                   # rows currently in the tree
+        self.tree_item_to_data_index = {}
+        self.time_index = None                 # TimeIndex, built on first draw
+        self.time_view = None                  # (lo, hi) ms shown on the timeline
+        self.time_range = None                 # (lo, hi) ms time filter
+        self._drag_start = None
+        self.preview = None                    # estimated total while showing a sample
+        self.preview_label = None
+        self._approx_bytes = None
+        self._filter_after = None
+        self._applied_filter = None            # what the shown rows were filtered by
+        self._loading = loader is not None
+        self._closed = False
+
+        self.window = tk.Toplevel(self.root)
+        self.window.title(f"JSON Data - {filename}")
+        self._size_window()
+
+        self._build_filter_panel()
+        self._build_timeline()
+        self._build_tree()
+        self._build_buttons()
+
+        self.window.bind('<Destroy>', self._on_destroy, add='+')
+        app.data_windows.add(self)
 
+        # Initial display
+        self.update_treeview_display(self.rows)
+        if loader is None:
+            self._start_index_build()
+        else:
+            self._poll_loader()
 
-    def display_data_window(self, data, filename):
-        data_window = tk.Toplevel(self.root)
-        data_window.title(f"JSON Data - {filename}")
+        # Force window to update and calculate proper size
+        self.window.update_idletasks()
 
-        # Calculate optimal window size based on content
-        if data:
+    # -------------------------------------------------
+    #   Layout
+    # -------------------------------------------------
+    def _size_window(self):
+        """Calculate optimal window size based on content"""
+        if self.rows:
             # Get approximate width needed for all columns
-            max_width = 0
-            for row in data:
-                row_width = sum(len(str(row.get(col, ''))) for col in COLUMNS)
-                if row_width > max_width:
-                    max_width = row_width
+            max_width = self.stats.row_width()
 
             # Calculate window dimensions (add some padding)
             window_width = min(max(800, max_width * 8), 2000)  # Min 800px, max 2000px
-            window_height = min(600, len(data) * 25 + 150)  # Dynamic height based on rows
+            window_height = min(600, len(self.rows) * 25 + 150)  # Dynamic height based on rows
 
-            data_window.geometry(f"{window_width}x{window_height}")
+            self.window.geometry(f"{window_width}x{window_height}")
         else:
-            data_window.geometry("800x400")
-
-
-        # Create local copies for this window instance to avoid cross-window interference
-        original_data = data.copy()
-        filtered_data = data.copy()
-
-        # Store original data for filtering (local to this function)
-        self.original_data = None  # Remove class-level reference
-        self.filtered_data = None  # Remove class-level reference
+            self.window.geometry("800x400")
 
+    def _build_filter_panel(self):
         # Create frame to hold Treeview and scrollbars
-        table_frame = ttk.Frame(data_window)
-        table_frame.pack(fill="both", expand=True)
+        self.table_frame = ttk.Frame(self.window)
+        self.table_frame.pack(fill="both", expand=True)
 
-        # -------------------------------------------------
-        #   Filter panel inside the data‑window
-        # -------------------------------------------------
-        filter_panel = ttk.LabelFrame(table_frame, text="Filter rows")
+        filter_panel = ttk.LabelFrame(self.table_frame, text="Filter rows")
         filter_panel.grid(row=0, column=0, columnspan=2,
-                         sticky='ew', padx=5, pady=(0, 5))
+                          sticky='ew', padx=5, pady=(0, 5))
 
-        # Source combobox in data window
-        self.src_cb_dw, self.src_var_dw = self._make_history_combobox(
+        # Source combobox
+        self.src_cb, self.src_var = self.app._make_history_combobox(
             filter_panel, "src", 20)
         ttk.Label(filter_panel, text="Source:").grid(row=0, column=0,
                                                     sticky='e', padx=2, pady=2)
-        self.src_cb_dw.grid(row=0, column=1, sticky='w', padx=2, pady=2)
+        self.src_cb.grid(row=0, column=1, sticky='w', padx=2, pady=2)
 
-        # Destination combobox in data window
-        self.dst_cb_dw, self.dst_var_dw = self._make_history_combobox(
+        # Destination combobox
+        self.dst_cb, self.dst_var = self.app._make_history_combobox(
             filter_panel, "dst", 20)
         ttk.Label(filter_panel, text="Destination:").grid(row=0,
                                                          column=2,
                                                          sticky='e',
                                                          padx=2, pady=2)
-        self.dst_cb_dw.grid(row=0, column=3, sticky='w', padx=2, pady=2)
+        self.dst_cb.grid(row=0, column=3, sticky='w', padx=2, pady=2)
 
-        # Destination Port combobox in data window
-        self.port_cb_dw, self.port_var_dw = self._make_history_combobox(
+        # Destination Port combobox
+        self.port_cb, self.port_var = self.app._make_history_combobox(
             filter_panel, "port", 10)
         ttk.Label(filter_panel,
-                  text="Destination Port:").grid(row=0, column=4,
+                  text="Destination Port:").grid(row=0, column=4,
                                                 sticky='e',
                                                 padx=2, pady=2)
-        self.port_cb_dw.grid(row=0, column=5, sticky='w', padx=2, pady=2)
-
-
-        # Filter button
-        filter_btn = ttk.Button(filter_panel,
-                                text="Apply Filter")
-        filter_btn.grid(row=0, column=6, padx=8, pady=2)
-
-        clear_filter_btn = ttk.Button(filter_panel, text="Clear Filter")
-        clear_filter_btn.grid(row=0, column=7, padx=8, pady=2)
-
-        # Clear History button (adds a small gap)
-        self.clear_hist_btn = ttk.Button(
-            filter_panel, 
-            text="Clear History",
-            command=self._clear_history)
-        self.clear_hist_btn.grid(row=0, column=8, padx=8, pady=2)
-
-
-
+        self.port_cb.grid(row=0, column=5, sticky='w', padx=2, pady=2)
 
-        # Define columns for the Treeview
-        columns = [
-            "Timestamp", "vnet", "nsg", "rule", "sourceIP", "destIP", "sourcePort",
-            "destPort", "proto", "trafficFlow", "flowState",
-            "encryption", "packetsSrcToDest",
-            "bytesSrcToDest", "packetsDstToSrc", "bytesDestToSrc"
-        ]
+        # Filter / Clear / Clear History buttons
+        ttk.Button(filter_panel, text="Apply Filter",
+                   command=self.apply_row_filter).grid(row=0, column=6,
+                                                       padx=8, pady=2)
+        ttk.Button(filter_panel, text="Clear Filter",
+                   command=self.clear_filters).grid(row=0, column=7,
+                                                    padx=8, pady=2)
+        ttk.Button(filter_panel, text="Clear History",
+                   command=self.app._clear_history).grid(row=0, column=8,
+                                                         padx=8, pady=2)
+
+        # Query expression over all columns (errors are shown next to it)
+        self.query_cb, self.query_var = self.app._make_history_combobox(
+            filter_panel, "query", 60)
+        ttk.Label(filter_panel, text="Query:").grid(row=1, column=0,
+                                                   sticky='e', padx=2, pady=2)
+        self.query_cb.grid(row=1, column=1, columnspan=5, sticky='we',
+                           padx=2, pady=2)
+        self.query_msg = ttk.Label(filter_panel, text="", foreground="#a00000")
+        self.query_msg.grid(row=1, column=6, columnspan=3, sticky='w',
+                            padx=8, pady=2)
+
+        # <Return> applies at once; typing in the three boxes filters as you
+        # type, debounced so a burst of keystrokes costs one lookup
+        for cb in (self.src_cb, self.dst_cb, self.port_cb, self.query_cb):
+            cb.bind('<Return>', self.apply_row_filter)
+        for cb in (self.src_cb, self.dst_cb, self.port_cb):
+            cb.bind('<KeyRelease>', self.schedule_filter, add='+')
+            cb.bind('<<ComboboxSelected>>', self.apply_row_filter, add='+')
+
+    def _build_timeline(self):
+        bar = ttk.Frame(self.table_frame)
+        bar.grid(row=1, column=0, columnspan=2, sticky='ew', padx=5)
+
+        ttk.Label(bar, text="Timeline:").pack(side='left')
+        self.timeline_metric = tk.StringVar(value="Flows")
+        metric_cb = ttk.Combobox(bar, textvariable=self.timeline_metric,
+                                 values=["Flows", "Bytes"], state='readonly',
+                                 width=7)
+        metric_cb.pack(side='left', padx=5)
+        metric_cb.bind('<<ComboboxSelected>>', lambda e: self.draw_timeline())
+        ttk.Button(bar, text="Zoom to Selection",
+                   command=self.zoom_to_selection).pack(side='left', padx=5)
+        ttk.Button(bar, text="Reset Zoom",
+                   command=self.reset_zoom).pack(side='left', padx=5)
+        ttk.Button(bar, text="Clear Time Filter",
+                   command=self.clear_time_filter).pack(side='left', padx=5)
+        self.timeline_label = ttk.Label(
+            bar, text="drag to filter by time, mouse wheel to zoom")
+        self.timeline_label.pack(side='left', padx=10)
+
+        canvas = tk.Canvas(self.table_frame, height=self.TIMELINE_HEIGHT,
+                           background="white", highlightthickness=0)
+        canvas.grid(row=2, column=0, columnspan=2, sticky='ew', padx=5, pady=(0, 5))
+        canvas.bind('<Configure>', lambda e: self.draw_timeline())
+        canvas.bind('<ButtonPress-1>', self._timeline_press)
+        canvas.bind('<B1-Motion>', self._timeline_drag)
+        canvas.bind('<ButtonRelease-1>', self._timeline_release)
+        canvas.bind('<MouseWheel>', self._timeline_wheel)     # Windows / macOS
+        canvas.bind('<Button-4>', self._timeline_wheel)       # X11 wheel up
+        canvas.bind('<Button-5>', self._timeline_wheel)       # X11 wheel down
+        self.timeline = canvas
+
+    def _build_tree(self):
+        columns = self.columns
+        table_frame = self.table_frame
 
         # Create Treeview inside the frame
         tree = ttk.Treeview(table_frame, columns=columns, show='headings')
         for col in columns:
-            tree.heading(col, text=col)
+            tree.heading(col, text=col,
+                         command=lambda c=col: self.sort_by_column(c))
             tree.column(col, width=100, anchor="center")
+        self.tree = tree
 
-        # Auto-size columns based on content after initial display
-        def autosize_after_fill():
-            self._autosize_tree_columns(tree, columns, original_data)
-
-        # Schedule it a moment later so the widget exists and has its rows
-        data_window.after(150, autosize_after_fill)
-
+        # Schedule autosize a moment later so the widget exists and has its rows
+        self.window.after(150, self.autosize_columns)
 
         # Add scrollbars
         scrollbar_y = tk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
@@ -863,8 +3482,6 @@ class JSONViewerApp:
 
         # Link scrollbars to Treeview
         tree.config(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
-        scrollbar_y.config(command=tree.yview)
-        scrollbar_x.config(command=tree.xview)
 
         # Pack the Treeview and scrollbars in a grid-like layout
         tree.grid(row=3, column=0, sticky="nsew")
@@ -875,176 +3492,570 @@ class JSONViewerApp:
         table_frame.grid_rowconfigure(3, weight=1)
         table_frame.grid_columnconfigure(0, weight=1)
 
-        # Store mapping from item ID to data index
-        self.tree_item_to_data_index = {}
-
-        def update_treeview_display(data_to_display):
-            # Clear existing items
-            for item in tree.get_children():
-                tree.delete(item)
-
-            # Populate with filtered data
-            for idx, row in enumerate(data_to_display):
-                values = [str(row[col]) for col in columns]
-                item_id = tree.insert("", "end", values=values)
-                self.tree_item_to_data_index[item_id] = idx
-
-                # Apply deny tag if flow state is 'D (Deny)'
-                if row.get('flowState', '') == 'D (Deny)':
-                    tree.item(item_id, tags='deny')
-
-                # Apply platform rule tag if rule is 'PlatformRule'
-                if row.get('rule', '') == 'PlatformRule':
-                    tree.item(item_id, tags='platform_rule')
-        # -------------------------------------------------
-        #   Row‑filter based on Source / Destination / Port
-        # -------------------------------------------------
-        def apply_row_filter(event=None):
-            """Filter `original_data` using the three precise fields (AND logic)."""
-            src_val = self.src_var_dw.get().strip()
-            dst_val = self.dst_var_dw.get().strip()
-            port_val = self.port_var_dw.get().strip()
-
-            # If all are empty just show original data
-            if not any([src_val, dst_val, port_val]):
-                update_treeview_display(original_data)
-                return
-
-            def row_matches(row):
-                # All comparisons are case‑insensitive string contains
-                if src_val and src_val.lower() not in str(row.get('sourceIP', '')).lower():
-                    return False
-                if dst_val and dst_val.lower() not in str(row.get('destIP', '')).lower():
-                    return False
-                if port_val and port_val.lower() not in str(row.get('destPort', '')).lower():
-                    return False
-                return True
-
-            filtered = [r for r in original_data if row_matches(r)]
-            update_treeview_display(filtered)
-
-        def clear_filters():
-            """Reset entry widgets, show all rows again."""
-            self.src_cb_dw.set("")
-            self.dst_cb_dw.set("")
-            self.port_cb_dw.set("")
-            update_treeview_display(original_data)
-
-
-        # Bind the button to the helper
-        clear_filter_btn.configure(command=clear_filters)
-
-
-        # Bind button click and <Return> on any of the three entries
-        # Bind button click and <Return> on any of the three comboboxes
-        filter_btn.configure(command=apply_row_filter)
-
-        # The filter fields in the data window are Combobox widgets:
-        self.src_cb_dw.bind('<Return>', apply_row_filter)
-        self.dst_cb_dw.bind('<Return>', apply_row_filter)
-        self.port_cb_dw.bind('<Return>', apply_row_filter)
-
-
-        # Initial display
-        update_treeview_display(original_data)
-
-        # Precompute column index mapping once
-        column_indices = {col: idx for idx, col in enumerate(columns)}
-
-
-        self.data = data  # Assuming 'data' is the processed data
-
         # Configure tags for highlighting
         tree.tag_configure("deny", background="#ffcccc")  # Light red for deny flows
         tree.tag_configure("platform_rule", background="#add8e6")  # Light blue for PlatformRule
 
+    def _build_buttons(self):
+        button_frame = ttk.Frame(self.window)
+        button_frame.pack(pady=5)
 
+        ttk.Button(button_frame, text="Copy(CSV)",
+                   command=self.copy_to_clipboard).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Copy(Excel)",
+                   command=self.copy_to_excel).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Sessions",
+                   command=self.show_sessions).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Close",
+                   command=self.window.destroy).pack(side='left', padx=5)
+
+        # Rows held by this window and their approximate memory
+        self.memory_label = ttk.Label(button_frame, text="")
+        self.memory_label.pack(side='left', padx=10)
+
+        if self.loader is not None:
+            self.load_label = ttk.Label(button_frame, text="Loading …")
+            self.load_label.pack(side='left', padx=10)
+            self.cancel_btn = ttk.Button(button_frame, text="Cancel Load",
+                                         command=self.loader.cancel)
+            self.cancel_btn.pack(side='left', padx=5)
+        self._update_memory_label()
+
+    def autosize_columns(self):
+        if not self._closed:
+            self.app._autosize_tree_columns(self.tree, self.columns, self.stats)
 
-        # -----------------------------------------------------------------
-        # Keep a reference to the rows that are shown in the Treeview.
-        # It will be updated by `update_treeview_display`.
-        # -----------------------------------------------------------------
-        self._shown_rows = original_data[:]   # start with the full set
-
-
-        def update_treeview_display(data_to_display):
-            """Refresh the tree and remember which rows are visible."""
-            # clear existing items
-            for item in tree.get_children():
-                tree.delete(item)
-
-            # fill with the new data
-            for idx, row in enumerate(data_to_display):
-                values = [str(row[col]) for col in columns]
-                item_id = tree.insert("", "end", values=values)
-                self.tree_item_to_data_index[item_id] = idx
-
-                # tags …
-                if row.get('flowState', '') == 'D (Deny)':
-                    tree.item(item_id, tags='deny')
-                if row.get('rule', '') == 'PlatformRule':
-                    tree.item(item_id, tags='platform_rule')
-
-            # remember the rows that are currently shown
-            self._shown_rows = list(data_to_display)
-
+    # -------------------------------------------------
+    #   Memory ownership
+    # -------------------------------------------------
+    def approx_bytes(self):
+        """Approximate memory held by this window's rows (cached until rows change)."""
+        if self._approx_bytes is None:
+            self._approx_bytes = estimate_rows_bytes(self.rows)
+        return self._approx_bytes
+
+    def _update_memory_label(self):
+        self.memory_label.config(
+            text=f"{len(self.rows):,} rows held, ~{format_mb(self.approx_bytes())}")
+
+    def _on_destroy(self, event):
+        """Drop every reference to the dataset when the window closes."""
+        if event.widget is not self.window or self._closed:
+            return
+        self._closed = True
+        if self.loader is not None:
+            self.loader.cancel()
+        self.app.data_windows.discard(self)
+        self.rows = []
+        self.shown_rows = []
+        self.shown_idx = []
+        self.sort_perms.clear()
+        self.tree_item_to_data_index.clear()
+        self.index = None
+        self.time_index = None
+        self.stats = None
+        self._approx_bytes = 0
 
-        # -----------------------------------------------------------------
-        # Copy functions – now use `self._shown_rows` (filtered view)
-        # -----------------------------------------------------------------
-        def copy_to_clipboard():
-            """Copy CSV of whatever rows are presently displayed."""
-            if not self._shown_rows:
-                return
+    # -------------------------------------------------
+    #   Column sorting
+    # -------------------------------------------------
+    # Sorting works on row indices into `self.rows`: one ascending
+    # permutation per column is computed from the typed keys and cached,
+    # a descending sort simply walks the cached permutation backwards.
+    def sorted_permutation(self, col):
+        perm = self.sort_perms.get(col)
+        if perm is None:
+            ci = COLUMNS.index(col)
+            keys = [r[SORT_KEYS][ci] if SORT_KEYS in r else str(r.get(col, ''))
+                    for r in self.rows]
+            perm = sorted(range(len(keys)), key=keys.__getitem__)
+            self.sort_perms[col] = perm
+        return perm
+
+    def ordered(self, indices):
+        """Return `indices` in the current sort order."""
+        if self.sort_col is None:
+            return indices
+        perm = self.sorted_permutation(self.sort_col)
+        if len(indices) != len(perm):
+            keep = set(indices)
+            perm = [i for i in perm if i in keep]
+        return perm[::-1] if self.sort_reverse else perm
+
+    def show_indices(self, indices):
+        self.shown_idx = indices
+        self.update_treeview_display([self.rows[i] for i in self.ordered(indices)])
+
+    def sort_by_column(self, col):
+        """Header click: sort ascending, click again to reverse."""
+        if self.sort_col == col:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_col = col
+            self.sort_reverse = False
+        arrow = " ▼" if self.sort_reverse else " ▲"
+        for c in self.columns:
+            self.tree.heading(c, text=c + (arrow if c == col else ""))
+        self.show_indices(self.shown_idx)
 
-            csv_data = ','.join(columns) + '\n'
-            for row in self._shown_rows:          # <-- filtered / shown rows
-                values = [str(row[col]) for col in columns]
-                csv_data += ','.join(values) + '\n'
+    # -------------------------------------------------
+    #   Timeline strip: histogram, zoom, time-range filter
+    # -------------------------------------------------
+    TIMELINE_HEIGHT = 80
+    BIN_PX = 4                    # width of one histogram bin in pixels
+
+    def get_time_index(self):
+        if self.time_index is None:
+            self.time_index = TimeIndex(self.rows)
+        return self.time_index
+
+    def _x_to_time(self, x):
+        lo, hi = self.time_view
+        width = max(1, self.timeline.winfo_width())
+        return lo + (hi - lo) * min(max(x, 0), width) / width
+
+    def _time_to_x(self, t):
+        lo, hi = self.time_view
+        return (t - lo) / (hi - lo) * self.timeline.winfo_width()
+
+    def draw_timeline(self):
+        """Histogram of the visible time range; only its bins are computed."""
+        if self._closed:
+            return
+        canvas = self.timeline
+        canvas.delete('all')
+        if self._loading and self.preview is None:
+            canvas.create_text(5, 5, anchor='nw', text="Loading …")
+            return
+        time_index = self.get_time_index()
+        if not len(time_index):
+            canvas.create_text(5, 5, anchor='nw', text="No timestamps")
+            return
+        if self.time_view is None:
+            self.time_view = time_index.span()
+        lo, hi = self.time_view
+
+        width = max(canvas.winfo_width(), 200)
+        height = self.TIMELINE_HEIGHT
+        top, bottom = 12, height - 14
+        nbins = max(1, width // self.BIN_PX)
+        bins = time_index.histogram(lo, hi, nbins)
+        use_bytes = self.timeline_metric.get() == "Bytes"
+        peak = max(b[2] if use_bytes else b[1] for b in bins) or 1
+        bin_w = width / nbins
+
+        for k, (_, flows, nbytes, denies) in enumerate(bins):
+            value = nbytes if use_bytes else flows
+            x0 = k * bin_w
+            x1 = x0 + max(1.0, bin_w - 1)
+            if value:
+                y = bottom - value / peak * (bottom - top)
+                canvas.create_rectangle(x0, y, x1, bottom, fill="#7aa6d6", outline="")
+            if denies:
+                # denied tuples carry no bytes: in Bytes mode mark the bin
+                y = (bottom - denies / peak * (bottom - top) if not use_bytes
+                     else bottom - 3)
+                canvas.create_rectangle(x0, y, x1, bottom, fill="#e06666", outline="")
+
+        if self.time_range is not None:
+            x0, x1 = (self._time_to_x(t) for t in self.time_range)
+            canvas.create_rectangle(x0, 0, x1, height, outline="#b8860b",
+                                    fill="#ffd966", stipple="gray25")
+
+        canvas.create_text(2, 0, anchor='nw', font=("TkDefaultFont", 7),
+                           text=f"peak {peak:,} {'bytes' if use_bytes else 'flows'}/bin")
+        canvas.create_text(2, height, anchor='sw', font=("TkDefaultFont", 7),
+                           text=_format_epoch_ms(int(lo)))
+        canvas.create_text(width - 2, height, anchor='se', font=("TkDefaultFont", 7),
+                           text=_format_epoch_ms(int(hi)))
+
+    def _timeline_press(self, event):
+        if self.time_view is not None:
+            self._drag_start = event.x
+
+    def _timeline_drag(self, event):
+        if self._drag_start is None:
+            return
+        self.timeline.delete('drag')
+        self.timeline.create_rectangle(self._drag_start, 0, event.x,
+                                       self.TIMELINE_HEIGHT, outline="#b8860b",
+                                       tags='drag')
+
+    def _timeline_release(self, event):
+        start, self._drag_start = self._drag_start, None
+        self.timeline.delete('drag')
+        if start is None or abs(event.x - start) < 3:
+            return                      # a click, not a drag
+        a, b = sorted((start, event.x))
+        self.time_range = (int(self._x_to_time(a)), int(self._x_to_time(b)) + 1)
+        self.apply_row_filter()
+        self.draw_timeline()
+
+    def _timeline_wheel(self, event):
+        """Zoom in/out around the pointer, within the data's time span."""
+        if self.time_view is None or self.time_index is None:
+            return
+        zoom_in = event.num == 4 or getattr(event, 'delta', 0) > 0
+        factor = 0.5 if zoom_in else 2.0
+        lo, hi = self.time_view
+        t = self._x_to_time(event.x)
+        full_lo, full_hi = self.time_index.span()
+        new_lo = max(full_lo, t - (t - lo) * factor)
+        new_hi = min(full_hi, t + (hi - t) * factor)
+        if new_hi - new_lo < 1000:      # one second is as close as it gets
+            return
+        self.time_view = (new_lo, new_hi)
+        self.draw_timeline()
 
-            self.root.clipboard_clear()
-            self.root.clipboard_append(csv_data)
+    def zoom_to_selection(self):
+        if self.time_range is not None:
+            self.time_view = self.time_range
+            self.draw_timeline()
 
+    def reset_zoom(self):
+        self.time_view = None
+        self.draw_timeline()
 
-        def copy_to_excel():
-            """Copy tab‑separated data of the currently displayed rows."""
-            if not self._shown_rows:
-                return
+    def clear_time_filter(self):
+        if self.time_range is not None:
+            self.time_range = None
+            self.apply_row_filter()
+            self.draw_timeline()
 
-            excel_cols = [
-                "Timestamp", "vnet", "nsg", "rule", "sourceIP", "destIP",
-                "sourcePort", "destPort", "proto", "trafficFlow", "flowState",
-                "encryption", "packetsSrcToDest", "bytesSrcToDest",
-                "packetsDstToSrc", "bytesDestToSrc"
-            ]
+    def _time_filtered(self, indices):
+        """
+        Restrict `indices` (None = all rows) to the selected time range.
+        The range is located in the time index by binary search; a small
+        candidate list is checked directly instead.
+        """
+        if self.time_range is None:
+            return list(range(len(self.rows))) if indices is None else indices
+        lo, hi = self.time_range
+        selected = self.get_time_index().range_indices(lo, hi)
+        if indices is None:
+            return sorted(selected)
+        if len(selected) < len(indices):
+            keep = set(selected)
+            return [i for i in indices if i in keep]
+        rows = self.rows
+        return [i for i in indices if lo <= rows[i][SORT_KEYS][_TS_COL] < hi]
+
+    def _update_timeline_label(self):
+        if self.time_range is None:
+            text = "drag to filter by time, mouse wheel to zoom"
+        else:
+            lo, hi = self.time_range
+            text = (f"{_format_epoch_ms(lo)} – {_format_epoch_ms(hi)}: "
+                    f"{len(self.shown_idx):,} rows")
+        self.timeline_label.config(text=text)
 
-            tsv_data = '\t'.join(excel_cols) + '\n'
-            for row in self._shown_rows:          # filtered / shown rows
-                values = [str(row[col]) for col in excel_cols]
-                tsv_data += '\t'.join(values) + '\n'
+    # -------------------------------------------------
+    #   Row filter: Source / Destination / Port + query
+    # -------------------------------------------------
+    def _start_index_build(self):
+        """Build the inverted index in the background; until it is ready the
+        filter falls back to a linear scan."""
+        rows = self.rows
+
+        def build():
+            index = RowIndex(rows)
+            if not self._closed:
+                self.index = index
+
+        threading.Thread(target=build, daemon=True).start()
+
+    def criteria(self):
+        return {"sourceIP": self.src_var.get().strip(),
+                "destIP": self.dst_var.get().strip(),
+                "destPort": self.port_var.get().strip()}
+
+    def filter_active(self):
+        return (any(self.criteria().values()) or bool(self.query_var.get().strip())
+                or self.time_range is not None)
+
+    def set_filters(self, src="", dst="", port="", query=""):
+        """Fill the filter boxes (e.g. from the main window) and apply them."""
+        self.src_cb.set(src)
+        self.dst_cb.set(dst)
+        self.port_cb.set(port)
+        self.query_cb.set(query)
+        self.apply_row_filter()
+
+    def apply_row_filter(self, event=None):
+        """
+        Filter `self.rows` using the three precise fields (AND logic,
+        "quoted" = exact), the query expression and the timeline range.
+        """
+        criteria = self.criteria()
+        query_text = self.query_var.get().strip()
+        self._applied_filter = self._filter_state()
+
+        # If all are empty just show original data (or the time range)
+        if not any(criteria.values()) and not query_text:
+            self.query_msg.config(text="")
+            self.show_indices(self._time_filtered(None))
+            self._update_timeline_label()
+            return
 
-            self.root.clipboard_clear()
-            self.root.clipboard_append(tsv_data)
+        index = self.index
+        try:
+            if index is not None:
+                # the three fields come from the index, the query
+                # is evaluated on the surviving rows only
+                query = compile_query(query_text) if query_text else None
+            else:
+                query = compile_query(combine_queries(
+                    criteria_query(criteria), query_text))
+        except QueryError as e:
+            self.query_msg.config(text=str(e))
+            self._applied_filter = None
+            return
+        self.query_msg.config(text="")
 
+        if index is not None:
+            indices = index.search(criteria)
+            if query is not None:
+                indices = query.filter_indices(self.rows, indices)
+        else:
+            indices = query.filter_indices(self.rows)
+        self.show_indices(self._time_filtered(indices))
+        self._update_timeline_label()
+
+    def _filter_state(self):
+        return (tuple(self.criteria().values()), self.query_var.get().strip(),
+                self.time_range, len(self.rows))
+
+    def schedule_filter(self, event=None):
+        if self._filter_after is not None:
+            self.window.after_cancel(self._filter_after)
+        self._filter_after = self.window.after(FILTER_DEBOUNCE_MS,
+                                               self._run_scheduled_filter)
+
+    def _run_scheduled_filter(self):
+        # <KeyRelease> also fires for Return, arrows, Shift, Tab …; only
+        # rebuild the table when the filter (or the data) actually changed
+        self._filter_after = None
+        if self._filter_state() != self._applied_filter:
+            self.apply_row_filter()
+
+    def clear_filters(self):
+        """Reset entry widgets, show all rows again."""
+        for cb in (self.src_cb, self.dst_cb, self.port_cb, self.query_cb):
+            cb.set("")
+        self.query_msg.config(text="")
+        self.time_range = None
+        self._applied_filter = None
+        self.show_indices(list(range(len(self.rows))))
+        self._update_timeline_label()
+        self.draw_timeline()
 
+    # -------------------------------------------------
+    #   Treeview
+    # -------------------------------------------------
+    def insert_tree_rows(self, rows_to_add):
+        """Append rows at the end of the tree."""
+        tree = self.tree
+        offset = len(self.shown_rows)
+        for idx, row in enumerate(rows_to_add, offset):
+            values = [str(row[col]) for col in self.columns]
+            item_id = tree.insert("", "end", values=values)
+            self.tree_item_to_data_index[item_id] = idx
+
+            # tags …
+            if row.get('flowState', '') == 'D (Deny)':
+                tree.item(item_id, tags='deny')
+            if row.get('rule', '') == 'PlatformRule':
+                tree.item(item_id, tags='platform_rule')
+
+        # remember the rows that are currently shown
+        self.shown_rows.extend(rows_to_add)
+
+    def update_treeview_display(self, data_to_display):
+        """Refresh the tree and remember which rows are visible."""
+        self.tree.delete(*self.tree.get_children())
+        self.tree_item_to_data_index.clear()
+        self.shown_rows = []
+        self.insert_tree_rows(data_to_display)
 
-        # Create a frame for buttons
-        button_frame = ttk.Frame(data_window)
-        button_frame.pack(pady=5)
+    # -------------------------------------------------
+    #   Copy / sessions – work on the shown (filtered) rows
+    # -------------------------------------------------
+    def copy_to_clipboard(self):
+        """Copy CSV of whatever rows are presently displayed."""
+        self._copy_rows(',')
 
-        copy_btn1 = ttk.Button(button_frame, text="Copy(CSV)", command=copy_to_clipboard)
-        copy_btn1.pack(side='left', padx=5)
+    def copy_to_excel(self):
+        """Copy tab‑separated data of the currently displayed rows."""
+        self._copy_rows('\t')
 
-        copy_btn2 = ttk.Button(button_frame, text="Copy(Excel)", command=copy_to_excel)
-        copy_btn2.pack(side='left', padx=5)
+    def _copy_rows(self, sep):
+        if not self.shown_rows:
+            return
+        lines = [sep.join(self.columns)]
+        for row in self.shown_rows:
+            lines.append(sep.join(str(row[col]) for col in self.columns))
+        self.root.clipboard_clear()
+        self.root.clipboard_append('\n'.join(lines) + '\n')
 
-        close_btn = ttk.Button(button_frame, text="Close", command=data_window.destroy)
-        close_btn.pack(side='left', padx=5)
+    def show_sessions(self):
+        self.app.show_sessions_for_rows(
+            [self.rows[i] for i in self.shown_idx], self.filename)
 
-        # Force window to update and calculate proper size
-        data_window.update_idletasks()
+    # -------------------------------------------------
+    #   Background loading: progress, cancel, rows arriving in batches
+    # -------------------------------------------------
+    def _reset_derived(self):
+        """Forget everything computed from `self.rows` after it is replaced."""
+        self.index = None
+        self.sort_perms.clear()
+        self.time_index = None
+        self.time_view = None
+        self._approx_bytes = None
+
+    def _show_preview(self, rows, estimated):
+        """Show the sampled rows (with the current filters) until the full data arrives."""
+        self.preview = estimated
+        self.rows = rows
+        self.stats = ColumnStats.from_rows(rows)
+        self._reset_derived()
+        self.apply_row_filter()
+        self.draw_timeline()
+        self.autosize_columns()
+
+        lines = [f"Preview: {len(rows):,} sampled rows of ~{estimated:,} "
+                 f"estimated – the full file is loading in the background"]
+        for col, values in top_values(rows).items():
+            lines.append(f"{col}: " + ", ".join(f"{v} ({share:.0%})"
+                                                for v, share in values))
+        self.preview_label = ttk.Label(self.table_frame, text="\n".join(lines),
+                                       foreground="#7f6000", justify='left')
+        self.preview_label.grid(row=5, column=0, columnspan=2, sticky='w', padx=5)
+        self._update_memory_label()
+
+    def _replace_preview(self, rows):
+        """Swap the sample for the complete rows; the filters carry over."""
+        self.preview = None
+        self.preview_label.destroy()
+        self.preview_label = None
+        self.rows = rows
+        self._reset_derived()
+        self.apply_row_filter()
+
+    def _add_batch(self, batch):
+        if self.preview is not None:
+            return              # the sample stays up until the load is complete
+        first = len(self.rows)
+        self.rows.extend(batch)
+        self.sort_perms.clear()
+        self.time_index = None
+        self._approx_bytes = None
+        new_idx = range(first, len(self.rows))
+        if self.filter_active():
+            try:
+                query = compile_query(combine_queries(
+                    criteria_query(self.criteria()), self.query_var.get()))
+                new_idx = query.filter_indices(self.rows, new_idx)
+            except QueryError:
+                pass
+            if self.time_range is not None:
+                lo, hi = self.time_range
+                new_idx = [i for i in new_idx
+                           if lo <= self.rows[i][SORT_KEYS][_TS_COL] < hi]
+        # rows are appended as they come; the sort order (if any)
+        # is applied once the load is complete
+        self.shown_idx = self.shown_idx + list(new_idx)
+        self.insert_tree_rows([self.rows[i] for i in new_idx])
+
+    def _finish_load(self, stats):
+        # only loaders fill the cache, so stats are normally present
+        self.stats = stats if stats is not None else ColumnStats.from_rows(self.rows)
+        self._loading = False
+        self.draw_timeline()
+        self.cancel_btn.destroy()
+        self._start_index_build()
+        if self.sort_col is not None:
+            self.show_indices(self.shown_idx)
+        self.autosize_columns()
+        self._update_memory_label()
+
+    def _poll_loader(self):
+        if self._closed:
+            return
+        try:
+            while True:
+                msg = self.loader.messages.get_nowait()
+                if msg[0] == 'PROGRESS':
+                    _, done, total, n_records, n_rows = msg
+                    self.load_label.config(
+                        text=f"Loading … {done / 1048576:.1f}/"
+                             f"{total / 1048576:.1f} MB read, "
+                             f"{n_records:,} records, {n_rows:,} rows")
+                elif msg[0] == 'PREVIEW':
+                    self._show_preview(msg[1], msg[2])
+                elif msg[0] == 'ROWS':
+                    self._add_batch(msg[1])
+                elif msg[0] == 'DONE':
+                    self.load_label.config(text="")
+                    if self.preview is not None:
+                        self._replace_preview(msg[1])
+                    self._finish_load(msg[2])
+                    return
+                elif msg[0] == 'ERROR':
+                    self.load_label.config(text="Load failed")
+                    self.cancel_btn.destroy()
+                    self._loading = False
+                    self.draw_timeline()
+                    messagebox.showerror(
+                        "Error", f"Failed to open {self.filename}:\n{msg[1]}",
+                        parent=self.window)
+                    return
+        except queue.Empty:
+            pass
+        if self.loader.cancelled:
+            self.load_label.config(
+                text=f"Load cancelled – {len(self.rows):,} rows"
+                     + (" (sample)" if self.preview is not None else ""))
+            self.cancel_btn.destroy()
+            self._loading = False
+            self.draw_timeline()
+            self._update_memory_label()
+            return
+        self._update_memory_label()
+        self.window.after(100, self._poll_loader)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="NSG / vNet flow log viewer")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="run headless: evaluate saved rules on new flow logs in DIR")
+    parser.add_argument("--rules", default=RULES_FILE,
+                        help=f"rules file (default {RULES_FILE})")
+    parser.add_argument("--out", default="hits.jsonl",
+                        help="JSON Lines file hits are appended to (default hits.jsonl)")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL_SEC,
+                        help=f"seconds between scans (default {WATCH_INTERVAL_SEC})")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                        help=f"checkpoint file (default {CHECKPOINT_FILE})")
+    parser.add_argument("--once", action="store_true",
+                        help="scan once and exit")
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        try:
+            run_watch(args.watch, args.rules, args.out, args.interval,
+                      args.checkpoint, args.once)
+        except QueryError as e:
+            raise SystemExit(str(e))
+        except KeyboardInterrupt:
+            pass
+        return
 
-if __name__ == "__main__":
     root = tk.Tk()
     app = JSONViewerApp(root)
     root.mainloop()
+    app.flush_rollups()
+
+
+if __name__ == "__main__":
+    main()
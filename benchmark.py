@@ -0,0 +1,225 @@
+"""
+Benchmarks for NSGFlowLogReader.
+
+    python benchmark.py startup [--files N] [--runs R]
+    python benchmark.py parse [--tuples N] [--runs R]
+    python benchmark.py stats [--tuples N] [--runs R]
+
+startup   cold import of the module in a fresh interpreter, time until the
+          main window has been drawn (skipped without a display), and the
+          background file listing over a synthetic tree of N files.
+parse     parse throughput of parse_records over N synthetic vNet flow
+          tuples (best of R runs) and the memory the parsed rows hold,
+          measured with tracemalloc.
+stats     cost of the column widths a data window needs: gathered per
+          parsed batch (ColumnStats) versus the two row scans they replaced
+          (window width, then per-column autosize).
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+
+def _cold(snippet, runs):
+    """Median wall time (s) of `snippet` in a fresh interpreter; None on error."""
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", snippet], cwd=HERE,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            return None
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+IMPORT_SNIPPET = """
+import time
+t = time.perf_counter()
+import NSGFlowLogReader
+print(time.perf_counter() - t)
+"""
+
+WINDOW_SNIPPET = """
+import time
+t = time.perf_counter()
+import tkinter as tk
+import NSGFlowLogReader
+root = tk.Tk()
+app = NSGFlowLogReader.JSONViewerApp(root)
+root.update()
+print(time.perf_counter() - t)
+root.destroy()
+"""
+
+
+def _make_tree(top, n_files, per_dir=100):
+    for i in range(n_files):
+        d = os.path.join(top, f"h={i // per_dir:04d}")
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, f"PT1H-{i:06d}.json"), "w") as f:
+            f.write('{"records": []}')
+
+
+def bench_startup(args):
+    print(f"cold import:           {_cold(IMPORT_SNIPPET, args.runs) * 1000:8.1f} ms")
+    window = _cold(WINDOW_SNIPPET, args.runs)
+    if window is None:
+        print("main window drawn:     skipped (no display)")
+    else:
+        print(f"main window drawn:     {window * 1000:8.1f} ms")
+
+    import NSGFlowLogReader
+    with tempfile.TemporaryDirectory(prefix="nsgbench-") as top:
+        _make_tree(top, args.files)
+        t = time.perf_counter()
+        first = None
+        count = 0
+        for _ in NSGFlowLogReader.iter_flow_log_files(top):
+            count += 1
+            if count == NSGFlowLogReader.DISCOVERY_BATCH:
+                first = time.perf_counter() - t
+        total = time.perf_counter() - t
+    if first is not None:
+        print(f"first listing batch:   {first * 1000:8.1f} ms")
+    print(f"full listing:          {total * 1000:8.1f} ms  ({count:,} files)")
+
+
+def _synthetic_records(n_tuples, per_group=200, seed=1):
+    """vNet records with realistic repetition: a handful of NSGs, rules and
+    vNets and a small set of service ports, but tens of thousands of hosts,
+    ephemeral source ports and timestamps spread over seconds, so that
+    near-unique values are as common as they are in real logs."""
+    rnd = random.Random(seed)
+    hosts = [f"10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+             for _ in range(50000)]
+    ports = [22, 53, 80, 123, 443, 1433, 3389, 8080]
+    records, t = [], 1704103200000
+    while n_tuples > 0:
+        vnet = f"vnet-{rnd.randint(1, 5)}"
+        nsg = f"nsg-{rnd.randint(1, 20)}"
+        tuples = []
+        for _ in range(min(per_group, n_tuples)):
+            t += rnd.randint(0, 2000)
+            state = rnd.choice("BCED")
+            tuples.append(f"{t},{rnd.choice(hosts)},{rnd.choice(hosts)},"
+                          f"{rnd.randint(1024, 65535)},{rnd.choice(ports)},6,"
+                          f"{rnd.choice('IO')},{state},NX,"
+                          f"{rnd.randint(1, 50)},{rnd.randint(60, 90000)},"
+                          f"{rnd.randint(1, 50)},{rnd.randint(60, 90000)}")
+        n_tuples -= len(tuples)
+        records.append({
+            "time": "2024-01-01T10:00:00Z", "flowLogVersion": 4,
+            "targetResourceID": f"/subscriptions/s/resourceGroups/rg/providers/"
+                                f"Microsoft.Network/virtualNetworks/{vnet}",
+            "flowRecords": {"flows": [{
+                "aclID": f"/subscriptions/s/resourceGroups/rg/providers/"
+                         f"Microsoft.Network/networkSecurityGroups/{nsg}",
+                "flowGroups": [{"rule": f"rule-{rnd.randint(1, 30)}",
+                                "flowTuples": tuples}]}]}})
+    return records
+
+
+def bench_parse(args):
+    import NSGFlowLogReader
+    records = _synthetic_records(args.tuples)
+
+    best = None
+    for _ in range(args.runs):
+        gc.collect()
+        t = time.perf_counter()
+        rows = NSGFlowLogReader.parse_records(records)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+        del rows
+    print(f"parse:                 {best * 1000:8.1f} ms  "
+          f"({args.tuples / best:,.0f} tuples/s)")
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    rows = NSGFlowLogReader.parse_records(records)
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print(f"rows held:             {held / 1048576:8.1f} MB  "
+          f"({held / max(1, len(rows)):,.0f} bytes/row, {len(rows):,} rows)")
+
+
+def _best(func, runs):
+    best = None
+    for _ in range(runs):
+        gc.collect()
+        t = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _two_pass_scans(rows, columns):
+    """The scans data windows made before ColumnStats: the widest row for
+    the window size, then the longest cell of every column for autosize."""
+    max_width = 0
+    for row in rows:
+        row_width = sum(len(str(row.get(col, ''))) for col in columns)
+        if row_width > max_width:
+            max_width = row_width
+    widths = {}
+    for col in columns:
+        best = len(col)
+        for row in rows:
+            n = len(str(row.get(col, "")))
+            if n > best:
+                best = n
+        widths[col] = best
+    return max_width, widths
+
+
+def bench_stats(args):
+    import NSGFlowLogReader as m
+    rows = m.parse_records(_synthetic_records(args.tuples))
+    batch = m.LOAD_BATCH_ROWS
+
+    def column_stats():
+        # as the background loader does: one add per batch of parsed rows
+        stats = m.ColumnStats()
+        for i in range(0, len(rows), batch):
+            stats.add_rows(rows[i:i + batch])
+
+    inline = _best(column_stats, args.runs)
+    scans = _best(lambda: _two_pass_scans(rows, m.COLUMNS), args.runs)
+    print(f"ColumnStats (batched): {inline * 1000:8.1f} ms  ({len(rows):,} rows)")
+    print(f"old two row scans:     {scans * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    startup = sub.add_parser("startup", help="cold start and file listing")
+    startup.add_argument("--files", type=int, default=20000)
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+    parse = sub.add_parser("parse", help="parse throughput and row memory")
+    parse.add_argument("--tuples", type=int, default=200000)
+    parse.add_argument("--runs", type=int, default=3)
+    parse.set_defaults(func=bench_parse)
+    stats = sub.add_parser("stats", help="column statistics vs. row scans")
+    stats.add_argument("--tuples", type=int, default=200000)
+    stats.add_argument("--runs", type=int, default=3)
+    stats.set_defaults(func=bench_stats)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()